@@ -0,0 +1,226 @@
+import numpy as np
+import cv2
+import matplotlib.pyplot as plt
+from functools import lru_cache
+
+#numba is optional, without it the error diffusion kernel runs as plain python
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def FSDitherColor(path, palette, serpentine = False, cube_bits = 5):
+
+    """ Performs Floyd-Steinberg dithering of a color image to an arbitrary palette
+
+    Comment on Lookup: The nearest palette color is not searched for per pixel. Instead, a lookup
+                       cube with 2**cube_bits bins per channel is built once, holding the nearest
+                       palette entry for the center of each bin. Every pixel is then a single
+                       cube lookup no matter how large the palette is. The last few cubes built
+                       are kept, so dithering many images to the same palette builds it only once.
+
+    Args:
+        path (str or numpy.ndarray): Path to the image, or an already loaded 8-bit BGR image
+        palette (list): BGR colors in range [0:255] to dither to, e.g. from color.colorPalette(..., space = 'bgr')
+        serpentine (bool): Alternate the scan direction every row
+        cube_bits (int): [1:8] Bits per channel of the lookup cube. 8 gives an exact nearest color.
+
+    Returns:
+        dst (numpy.ndarray): Dithered BGR image (uint8, range [0:255])
+
+    To save images in another script, follow this guideline: cv2.imwrite(fname, dst)
+
+    """
+
+    palette = np.asarray(palette, dtype = np.float64)
+
+    #argcheck to make sure the palette is valid
+    if (palette.ndim != 2 or np.shape(palette)[1] != 3 or np.shape(palette)[0] < 1):
+
+        print("ERROR: PLEASE PROVIDE A PALETTE OF BGR COLORS")
+        return -1
+
+    if (cube_bits < 1 or cube_bits > 8):
+
+        print("ERROR: PLEASE ENTER A VALID NUMBER OF CUBE BITS")
+        return -1
+
+    #read in image as color (or take the array as given)
+    if (isinstance(path, np.ndarray)):
+
+        src = path
+
+    else:
+
+        src = cv2.imread(path, cv2.IMREAD_COLOR)
+
+    #get the rows, cols in the image
+    rows = np.shape(src)[0]
+    cols = np.shape(src)[1]
+
+    #the same palette is usually dithered to over and over, so its cube is only built once
+    cube = _cached_palette_cube(palette.tobytes(), cube_bits)
+
+    #instantiate storage for the dithered image
+    dst = np.empty((rows, cols, 3), dtype = np.uint8)
+
+    #the error carried into the first row is zero
+    err = np.zeros((cols + 2, 3))
+
+    shift = 8 - cube_bits
+
+    if (_diffuse_color_row_compiled is not None):
+
+        for r in range(0, rows):
+
+            reverse = serpentine and r % 2 == 1
+            next_err = np.zeros((cols + 2, 3))
+            _diffuse_color_row_compiled(src[r], dst[r], err, next_err, cube, palette, shift, reverse)
+            err = next_err
+
+        return dst
+
+    #python lists are much faster than numpy arrays for scalar work
+    err = err.tolist()
+    cube_list = cube.tolist()
+    palette_list = palette.tolist()
+
+    for r in range(0, rows):
+
+        reverse = serpentine and r % 2 == 1
+        out = [[0, 0, 0] for c in range(0, cols)]
+        next_err = [[0.0, 0.0, 0.0] for c in range(0, cols + 2)]
+        _diffuse_color_row(src[r].tolist(), out, err, next_err, cube_list, palette_list, shift, reverse)
+        dst[r] = out
+        err = next_err
+
+    return dst
+
+def paletteCube(palette, cube_bits):
+
+    """ Builds a lookup cube of the nearest palette entry for every bin of BGR space.
+
+    Args:
+        palette (list): BGR colors in range [0:255]
+        cube_bits (int): [1:8] Bits per channel of the cube
+
+    Returns:
+        cube (numpy.ndarray): (2**cube_bits, 2**cube_bits, 2**cube_bits) palette indices, indexed [b, g, r] >> (8 - cube_bits)
+
+    """
+
+    palette = np.asarray(palette, dtype = np.float64)
+
+    bins = 2 ** cube_bits
+    width = 256 / bins
+
+    #centers of the code values falling in every bin along one channel
+    centers = (np.arange(bins) * width) + ((width - 1) / 2)
+
+    b, g, r = np.meshgrid(centers, centers, centers, indexing = 'ij')
+    points = np.stack([b.ravel(), g.ravel(), r.ravel()], axis = 1)
+
+    cube = np.empty(len(points), dtype = np.int64)
+
+    #go in chunks so the distance table stays small for large cubes and palettes
+    chunk = 4096
+
+    for start in range(0, len(points), chunk):
+
+        block = points[start:start+chunk]
+        distance = np.sum(np.square(block[:, None, :] - palette[None, :, :]), axis = 2)
+        cube[start:start+chunk] = np.argmin(distance, axis = 1)
+
+    return cube.reshape(bins, bins, bins)
+
+@lru_cache(maxsize = 4)
+def _cached_palette_cube(palette_bytes, cube_bits):
+
+    """ paletteCube keyed by the raw bytes of a float64 BGR palette (read only) """
+
+    cube = paletteCube(np.frombuffer(palette_bytes, dtype = np.float64).reshape(-1, 3), cube_bits)
+    cube.setflags(write = False)
+
+    return cube
+
+def _diffuse_color_row(values, out, err, next_err, cube, palette, shift, reverse):
+
+    """ Floyd-Steinberg diffuses a single row of BGR code values against a palette.
+
+    Args:
+        values (sequence): The 8-bit BGR code values of the row
+        out (sequence): Storage for the dithered BGR code values of the row
+        err (sequence): BGR error carried into this row, padded with one slot on either side
+        next_err (sequence): Zeroed storage for the error carried into the next row, padded like err
+        cube (sequence): Lookup cube from paletteCube
+        palette (sequence): BGR colors of the palette
+        shift (int): Bits to drop from a code value to index the cube
+        reverse (bool): Scan the row right to left, mirroring the diffusion weights
+
+    """
+
+    cols = len(values)
+
+    if (reverse):
+
+        start, stop, direction = cols - 1, -1, -1
+
+    else:
+
+        start, stop, direction = 0, cols, 1
+
+    #error pushed to the next neighbor in the scan
+    carry_b = 0.0
+    carry_g = 0.0
+    carry_r = 0.0
+
+    for c in range(start, stop, direction):
+
+        #clamp to the gamut, so a palette that doesn't span it can't pile up error without bound
+        b = min(max(values[c][0] + err[c+1][0] + carry_b, 0.0), 255.0)
+        g = min(max(values[c][1] + err[c+1][1] + carry_g, 0.0), 255.0)
+        r = min(max(values[c][2] + err[c+1][2] + carry_r, 0.0), 255.0)
+
+        ib = int(b) >> shift
+        ig = int(g) >> shift
+        ir = int(r) >> shift
+
+        nearest = palette[cube[ib][ig][ir]]
+
+        out[c][0] = int(nearest[0] + 0.5)
+        out[c][1] = int(nearest[1] + 0.5)
+        out[c][2] = int(nearest[2] + 0.5)
+
+        error_b = b - nearest[0]
+        error_g = g - nearest[1]
+        error_r = r - nearest[2]
+
+        carry_b = error_b * 7/16
+        carry_g = error_g * 7/16
+        carry_r = error_r * 7/16
+
+        #the padding slots swallow any error pushed off the image
+        ahead = c + 1 + direction
+        behind = c + 1 - direction
+
+        next_err[ahead][0] = next_err[ahead][0] + (error_b * 1/16)
+        next_err[ahead][1] = next_err[ahead][1] + (error_g * 1/16)
+        next_err[ahead][2] = next_err[ahead][2] + (error_r * 1/16)
+
+        next_err[c+1][0] = next_err[c+1][0] + (error_b * 5/16)
+        next_err[c+1][1] = next_err[c+1][1] + (error_g * 5/16)
+        next_err[c+1][2] = next_err[c+1][2] + (error_r * 5/16)
+
+        next_err[behind][0] = next_err[behind][0] + (error_b * 3/16)
+        next_err[behind][1] = next_err[behind][1] + (error_g * 3/16)
+        next_err[behind][2] = next_err[behind][2] + (error_r * 3/16)
+
+#compiled once per process on first use. numba's disk cache is keyed by module name, which breaks
+#when this file is imported both on its own and as part of the package
+if (njit is not None):
+
+    _diffuse_color_row_compiled = njit(_diffuse_color_row)
+
+else:
+
+    _diffuse_color_row_compiled = None
@@ -1,17 +1,117 @@
+import os
+import time
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
-def FSDitherGray(path, levels):
+#numba is optional, without it the error diffusion kernel runs as plain python
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+#the selectable dithering modes
+MODES = ('floyd-steinberg', 'bayer', 'blue noise')
+
+def FSDitherGray(path, levels, mode = 'floyd-steinberg', serpentine = False, workers = None):
 
     """ Performs Floyd-Steinberg dithering for a grayscale (single channel) image
 
+    Comment on Modes: Error diffusion ('floyd-steinberg') is inherently sequential. The threshold
+                      map modes ('bayer' for 8x8 ordered dithering and 'blue noise' for a tiled
+                      64x64 blue-noise mask) handle every pixel independently, so they are fully
+                      vectorized and split into bands across a thread pool. All modes quantize
+                      to the same evenly spaced levels.
+
+    Args:
+        path (str or numpy.ndarray): Path to the image, or an already loaded 8-bit single channel image
+        levels (int): The number of ditherable gray levels
+        mode (str): {'floyd-steinberg', 'bayer', 'blue noise'} How to dither the image.
+        serpentine (bool): Alternate the scan direction every row. Only used by 'floyd-steinberg'.
+        workers (int): The number of threads for the threshold map modes. Defaults to the number of cores.
+
+    Returns:
+        dst (numpy.ndarray): Dithered image (uint8, range [0:255])
+
+    To save images in another script, follow this guideline: cv2.imwrite(fname, dst)
+
+    """
+
+    #argcheck to make sure levels is valid
+    if (levels <= 1 or levels > 256):
+
+        print("PLEASE ENTER A VALID LEVEL PARAMETER")
+        return -1
+
+    if (mode not in MODES):
+
+        print("ERROR: PLEASE ENTER A VALID DITHERING MODE.")
+        print("MODE REQUESTED:", mode)
+        return -1
+
+    #read in image as grayscale (or take the array as given)
+    if (isinstance(path, np.ndarray)):
+
+        src = path
+
+    else:
+
+        src = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+    #get the rows, cols in the image
+    rows = np.shape(src)[0]
+    cols = np.shape(src)[1]
+
+    #instantiate storage for the dithered image
+    dst = np.empty((rows, cols), dtype = np.uint8)
+
+    if (mode == 'floyd-steinberg'):
+
+        #the error carried into the first row is zero
+        err = np.zeros(cols + 2)
+
+        _diffuse_band(src, dst, err, levels, serpentine, 0)
+
+        return dst
+
+    mask = _threshold_mask(mode)
+
+    if (workers is None):
+
+        workers = os.cpu_count() or 1
+
+    #every band is independent, so hand one to each thread
+    band_rows = max(1, -(-rows // workers))
+
+    def dither_band(r):
+
+        _threshold_band(src[r:r+band_rows], dst[r:r+band_rows], levels, mask, r)
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+
+        list(pool.map(dither_band, range(0, rows, band_rows)))
+
+    return dst
+
+def FSDitherGrayStream(src_path, dst_path, levels, shape = None, band_rows = 256, mode = 'floyd-steinberg', serpentine = False):
+
+    """ Performs Floyd-Steinberg dithering on a grayscale image too large to hold in memory.
+        The image is read and written in bands of rows through memory maps, so peak memory
+        is bounded by a few bands no matter the size of the image.
+
     Args:
-        path (str): Path to the image
+        src_path (str): Path to the 8-bit single channel input, either a .npy file or raw bytes
+        dst_path (str): Path to write the dithered output to, either a .npy file or raw bytes
         levels (int): The number of ditherable gray levels
-            
+        shape (tuple): (rows, cols) of the input. Only required for raw input.
+        band_rows (int): The number of rows to read and dither at a time
+        mode (str): {'floyd-steinberg', 'bayer', 'blue noise'} How to dither the image.
+        serpentine (bool): Alternate the scan direction every row. Only used by 'floyd-steinberg'.
+
     Returns:
-        dst (numpy.ndarray): Floyd-Steinberg dithered image
+        dst (numpy.memmap): Floyd-Steinberg dithered image (uint8, range [0:255])
 
     """
 
@@ -21,40 +121,303 @@ def FSDitherGray(path, levels):
         print("PLEASE ENTER A VALID LEVEL PARAMETER")
         return -1
 
-    #read in image as grayscale
-    src = cv2.imread(path, cv2.IMREAD_GRAYSCALE) 
+    if (band_rows < 1):
+
+        print("PLEASE ENTER A VALID BAND SIZE")
+        return -1
 
-    #normalize image to range [0:1] (assuming 8-bit image)
-    src_norm = src / 255
+    if (mode not in MODES):
 
-    #get the rows, cols, chans in the image
+        print("ERROR: PLEASE ENTER A VALID DITHERING MODE.")
+        print("MODE REQUESTED:", mode)
+        return -1
+
+    src = _open_input(src_path, shape)
+
+    if (src is None):
+
+        print("ERROR: PLEASE PROVIDE THE SHAPE OF A RAW INPUT IMAGE")
+        return -1
+
+    if (src.ndim != 2):
+
+        print("ERROR: PLEASE PROVIDE A SINGLE CHANNEL IMAGE")
+        return -1
+
+    #get the rows, cols in the image
     rows = np.shape(src)[0]
     cols = np.shape(src)[1]
 
-    #instantiate storage for FS dithered image 
-    dst = np.zeros((rows,cols))
+    dst = _open_output(dst_path, (rows, cols))
+
+    #the error carried into the first row is zero
+    err = np.zeros(cols + 2)
 
-    #create array of available grayscale values that we can quantize to
-    my_available_values = np.linspace(0,1,levels)
+    for r in range(0, rows, band_rows):
 
-    for r in range(0,rows-1): #nb range limits to prevent core dump
+        #pull the band into memory, dither it and write it back out
+        band = np.array(src[r:r+band_rows], dtype = np.uint8)
+        out = np.empty(np.shape(band), dtype = np.uint8)
 
-        for c in range(1,cols-1): #nb range limits to prevent core dump
-           
-            current_value = src_norm[r,c]
+        if (mode == 'floyd-steinberg'):
 
-            #perform quantization (rounding)
-            absolute_distance_array = np.abs(my_available_values - current_value)
-            my_index = np.argmin(absolute_distance_array)
-            rounded_value = my_available_values[my_index]
+            err = _diffuse_band(band, out, err, levels, serpentine, r)
 
-            dst[r,c] = rounded_value
+        else:
 
-            error = current_value - rounded_value
+            _threshold_band(band, out, levels, _threshold_mask(mode), r)
 
-            src_norm[r,   c+1] = src_norm[r,   c+1] + (error * 7/16)
-            src_norm[r+1, c+1] = src_norm[r+1, c+1] + (error * 1/16)
-            src_norm[r+1, c  ] = src_norm[r+1, c  ] + (error * 5/16)
-            src_norm[r+1, c-1] = src_norm[r+1, c-1] + (error * 3/16)
+        dst[r:r+band_rows] = out
+
+    dst.flush()
 
     return dst
+
+def _open_input(path, shape):
+
+    """ Memory maps an 8-bit input image stored as .npy or raw bytes (None if a raw shape is missing) """
+
+    if (path.endswith('.npy')):
+
+        return np.load(path, mmap_mode = 'r')
+
+    if (shape is None):
+
+        return None
+
+    return np.memmap(path, dtype = np.uint8, mode = 'r', shape = tuple(shape))
+
+def _open_output(path, shape):
+
+    """ Memory maps a new uint8 output image stored as .npy or raw bytes """
+
+    if (path.endswith('.npy')):
+
+        return np.lib.format.open_memmap(path, mode = 'w+', dtype = np.uint8, shape = shape)
+
+    return np.memmap(path, dtype = np.uint8, mode = 'w+', shape = shape)
+
+def ditherBenchmark(rows = 2048, cols = 2048, levels = 2, repeats = 3, workers = None):
+
+    """ Measures the throughput of every dithering mode on a random image.
+
+    Args:
+        rows (int): Rows in the benchmark image
+        cols (int): Cols in the benchmark image
+        levels (int): The number of ditherable gray levels
+        repeats (int): How many times to time each mode. The best time is kept.
+        workers (int): The number of threads for the threshold map modes
+
+    Returns:
+        throughput (dict): Megapixels per second for each mode (and serpentine Floyd-Steinberg)
+
+    """
+
+    src = np.random.randint(0, 256, (rows, cols)).astype(np.uint8)
+
+    runs = [('floyd-steinberg', False), ('floyd-steinberg', True), ('bayer', False), ('blue noise', False)]
+
+    throughput = {}
+
+    for mode, serpentine in runs:
+
+        #warm up once so compilation and mask generation are not timed
+        FSDitherGray(src[:8], levels, mode, serpentine, workers)
+
+        best = np.inf
+
+        for repeat in range(0, repeats):
+
+            start = time.perf_counter()
+            FSDitherGray(src, levels, mode, serpentine, workers)
+            best = min(best, time.perf_counter() - start)
+
+        name = mode + (' (serpentine)' if serpentine else '')
+        throughput[name] = (rows * cols) / best / 1e6
+
+        print(name, ":", round(throughput[name], 2), "MP/s")
+
+    return throughput
+
+def _diffuse_row(values, out, err, next_err, levels, reverse):
+
+    """ Floyd-Steinberg diffuses a single row of code values.
+
+    Args:
+        values (sequence): The 8-bit code values of the row
+        out (sequence): Storage for the quantized code values of the row
+        err (sequence): Error carried into this row, padded with one slot on either side
+        next_err (sequence): Zeroed storage for the error carried into the next row, padded like err
+        levels (int): The number of ditherable gray levels
+        reverse (bool): Scan the row right to left, mirroring the diffusion weights
+
+    """
+
+    cols = len(values)
+
+    if (reverse):
+
+        start, stop, direction = cols - 1, -1, -1
+
+    else:
+
+        start, stop, direction = 0, cols, 1
+
+    #distance between two neighboring levels in code values
+    step = 255 / (levels - 1)
+    top = levels - 1
+
+    #error pushed to the right neighbor
+    carry = 0.0
+
+    for c in range(start, stop, direction):
+
+        value = values[c] + err[c+1] + carry
+
+        #perform quantization (rounding) arithmetically instead of searching the levels
+        level = int(value / step + 0.5)
+
+        if (level < 0):
+
+            level = 0
+
+        elif (level > top):
+
+            level = top
+
+        quantized = level * step
+
+        out[c] = int(quantized + 0.5)
+
+        error = value - quantized
+
+        #the padding slots swallow any error pushed off the image
+        ahead = c + 1 + direction
+        behind = c + 1 - direction
+        carry = error * 7/16
+        next_err[ahead ] = next_err[ahead ] + (error * 1/16)
+        next_err[c+1   ] = next_err[c+1   ] + (error * 5/16)
+        next_err[behind] = next_err[behind] + (error * 3/16)
+
+#compiled once per process on first use. numba's disk cache is keyed by module name, which breaks
+#when this file is imported both on its own and as part of the package
+if (njit is not None):
+
+    _diffuse_row_compiled = njit(_diffuse_row)
+
+else:
+
+    _diffuse_row_compiled = None
+
+def _diffuse_band(band, dst, err, levels, serpentine, first_row):
+
+    """ Floyd-Steinberg diffuses a band of rows, carrying the error in one row buffer.
+
+    Args:
+        band (numpy.ndarray): 8-bit rows to dither
+        dst (numpy.ndarray): uint8 storage for the dithered rows, same shape as band
+        err (numpy.ndarray): Error carried into the first row of the band (length cols + 2)
+        levels (int): The number of ditherable gray levels
+        serpentine (bool): Alternate the scan direction every row
+        first_row (int): Row of the image the band starts on, which fixes the scan directions
+
+    Returns:
+        err (numpy.ndarray): Error carried out of the last row of the band
+
+    """
+
+    rows = np.shape(band)[0]
+    cols = np.shape(band)[1]
+
+    if (_diffuse_row_compiled is not None):
+
+        for r in range(0, rows):
+
+            reverse = serpentine and (first_row + r) % 2 == 1
+            next_err = np.zeros(cols + 2)
+            _diffuse_row_compiled(band[r], dst[r], err, next_err, levels, reverse)
+            err = next_err
+
+        return err
+
+    #python lists are much faster than numpy arrays for scalar work
+    err = np.asarray(err).tolist()
+
+    for r in range(0, rows):
+
+        reverse = serpentine and (first_row + r) % 2 == 1
+        out = [0] * cols
+        next_err = [0.0] * (cols + 2)
+        _diffuse_row(band[r].tolist(), out, err, next_err, levels, reverse)
+        dst[r] = out
+        err = next_err
+
+    return np.asarray(err)
+
+def _threshold_band(band, dst, levels, mask, first_row):
+
+    """ Dithers a band of rows against a tiled threshold map.
+
+    Args:
+        band (numpy.ndarray): 8-bit rows to dither
+        dst (numpy.ndarray): uint8 storage for the dithered rows, same shape as band
+        levels (int): The number of ditherable gray levels
+        mask (numpy.ndarray): Square map of thresholds in (0:1)
+        first_row (int): Row of the image the band starts on, which keeps the tiling aligned across bands
+
+    """
+
+    rows = np.shape(band)[0]
+    cols = np.shape(band)[1]
+    size = np.shape(mask)[0]
+
+    #tile the map over the band, starting on the right row of the map
+    thresholds = mask[np.arange(first_row, first_row + rows) % size]
+    thresholds = np.tile(thresholds, (1, -(-cols // size)))[:, :cols]
+
+    #offset each pixel by its threshold before truncating to a level
+    level = np.floor(band * np.float32((levels - 1) / 255) + thresholds)
+    np.clip(level, 0, levels - 1, out = level)
+
+    #look the codes up so they round exactly as the error diffusion modes do
+    dst[...] = _level_codes(levels)[level.astype(np.intp)]
+
+@lru_cache(maxsize = None)
+def _level_codes(levels):
+
+    """ The 8-bit code value of every gray level, rounded half up like _diffuse_row (uint8) """
+
+    step = 255 / (levels - 1)
+
+    return np.array([int((level * step) + 0.5) for level in range(0, levels)], dtype = np.uint8)
+
+@lru_cache(maxsize = None)
+def _threshold_mask(mode):
+
+    """ Builds the threshold map for a threshold map dithering mode (values in (0:1), float32) """
+
+    if (mode == 'bayer'):
+
+        #grow the 2x2 index matrix recursively up to 8x8
+        index = np.array([[0, 2], [3, 1]])
+
+        while (np.shape(index)[0] < 8):
+
+            index = np.block([[4*index, 4*index + 2], [4*index + 3, 4*index + 1]])
+
+    elif (mode == 'blue noise'):
+
+        #high-pass filter white noise so the energy sits in the high frequencies
+        size = 64
+        noise = np.random.RandomState(0).rand(size, size)
+        frequency = np.hypot(*np.meshgrid(np.fft.fftfreq(size), np.fft.fftfreq(size)))
+        highpass = 1 - np.exp(-np.square(frequency / 0.2))
+        filtered = np.real(np.fft.ifft2(np.fft.fft2(noise) * highpass))
+
+        #rank the filtered noise so the thresholds are evenly distributed
+        index = np.argsort(np.argsort(filtered, axis = None)).reshape(size, size)
+
+    #center each threshold inside its bin
+    mask = (index + 0.5) / np.size(index)
+
+    return mask.astype(np.float32)
@@ -1,6 +1,8 @@
-from .FSDitherGray import FSDitherGray
-from .gameOfLife import gameOfLife
-from .doodle import doodle
-from .scramble import scramble
+from .FSDitherGray import FSDitherGray, FSDitherGrayStream, ditherBenchmark
+from .FSDitherColor import FSDitherColor, paletteCube
+from .gameOfLife import gameOfLife, lifeStep, packBoard, unpackBoard, packedLifeStep, lifeGenerations, lifeRecord, lifeRun, lifeParallel, lifeEnsemble, parseRule
+from .doodle import doodle, doodleRender, doodleVariants, doodleStart, doodleLines, DoodleImage
+from .scramble import scramble, unscramble, scrambleBatch, scrambleTiled, scramblePeriod
+from .pyrax import opticalSystem, paraxialTrace, systemMatrix, paraxialImage, paraxialSweep, readPrescription, pyraxBatch
 from .SIR import SIR
 from .bessel import bessel
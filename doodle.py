@@ -1,15 +1,17 @@
+import time
 import numpy as np
 import color
 import cv2
 import matplotlib.pyplot as plt
 from progressbar import ProgressBar
+from concurrent.futures import ProcessPoolExecutor
 
-def doodle(path, min_reach, max_reach, line_color, line_flexibility, number_of_line_colors, max_line_thickness, bkrd_color, canny_kernal_size, lines, view_pointmap):
+def doodle(path, min_reach, max_reach, line_color, line_flexibility, number_of_line_colors, max_line_thickness, bkrd_color, canny_kernal_size, lines, view_pointmap, canvas_dtype = np.float64, return_edgelist = False, seed = None, progress = None):
 
     """ Draws some lines, or something like that. 
 
     Args:
-        path (str): Path to the image.
+        path (str or DoodleImage): Path to the image, or an image prepared with DoodleImage to reuse its preprocessing.
         min_reach (float): The minimum distance that the origin of a line will search for an endpoint in pixel space.
         max_reach (float): The maximum distance that the origin of a line will search for an endpoint in pixel space.
         line_color (str): {'white', 'black', 'dark colors', 'light colors'} What color the lines should be. 
@@ -20,11 +22,16 @@ def doodle(path, min_reach, max_reach, line_color, line_flexibility, number_of_l
         canny_kernal_size (int): Square kernal size for canny edge detection. Larger values will "erode" image more.
         lines (int): The number of lines you would like to try and draw. 
         view_pointmap (bool): Option to see the binary pointmap of the image. Useful for canny_kernal_size decision.
-            
+        canvas_dtype (type): {np.float64, np.uint8} Draw on a float canvas in range [0:1] or a uint8 canvas in range [0:255] (8x less memory).
+        return_edgelist (bool): Also return the edgelist, so the drawing can be re-rendered with doodleRender.
+        seed (int): Seed for a reproducible drawing. Defaults to numpy's global random state.
+        progress (function): Called as progress(lines drawn, lines, seconds elapsed) as the drawing goes. Defaults to a ProgressBar.
+
     Returns:
         canvas (numpy.ndarray): The final drawing.
+        edgelist (list): Only if return_edgelist. The lines as [(source x, y), (sink x, y)] pairs.
 
-    To save images in another script, follow this guideline: cv2.imwrite(fname, canvas*255)
+    To save images in another script, follow this guideline: cv2.imwrite(fname, canvas*255) (or just canvas for a uint8 canvas)
 
     """
 
@@ -33,44 +40,200 @@ def doodle(path, min_reach, max_reach, line_color, line_flexibility, number_of_l
     #TODO: noise reduction for pointmap (or, edge enhancement?)
     '''
 
-    #read in image as grayscale
-    src = cv2.imread(path, cv2.IMREAD_GRAYSCALE) 
+    #read in image as grayscale (or reuse the prepared one)
+    if (isinstance(path, DoodleImage)):
+
+        image = path
+
+    else:
+
+        image = DoodleImage(path)
+
+    src = image.src
 
     #get the number of rows and cols in the image
     rows = np.shape(src)[0]
     cols = np.shape(src)[1]
 
-    #set up the background canvas that will be drawn on
-    if (bkrd_color == 'white'):
+    #check the background the canvas will be drawn on
+    if (bkrd_color != 'white' and bkrd_color != 'black'):
 
-        canvas = np.ones((rows,cols, 3)) 
-    
-    elif (bkrd_color == 'black'):
+        print("ERROR: PLEASE ENTER A VALID BACKGROUND COLOR.")
+        print("BACKGROUND COLOR REQUESTED:", bkrd_color)
+        return -1
+
+    #check reach and flexibility conditions
+    if (not _check_search(rows, cols, min_reach, max_reach, line_flexibility)):
+
+        return -1
+
+    #choose the line color(s) that will be drawn with
+    line_colors = image.palette(line_color, number_of_line_colors)
+
+    if (line_colors is None):
+
+        print("ERROR: PLEASE ENTER A VALID LINE COLOR.")
+        print("LINE COLOR REQUESTED:", line_color)
+        return -1
+
+    #get a binary pointmap for the image
+    pointmap = image.pointmap(canny_kernal_size)
+
+    #see how many points are possible
+    number_of_available_points = int(np.sum(pointmap))
+
+    #because of forbidden_points enforcement, catch inundation case
+    if (lines >= number_of_available_points):
 
-        canvas = np.zeros((rows, cols, 3))
+        print("ERROR: NOT ENOUGH AVAILABLE POINTS TO COMPLETE LINE REQUEST.")
+        print("TRY DECREASING KERNAL SIZE OR DECREASING NUMBER OF LINES REQUESTED.")
+        print("NUMBER OF AVAILABLE POINTS:", number_of_available_points)
+        return -1
+
+    #show the pointmap if the user wants it
+    if (view_pointmap == True):
+
+        plt.imshow(pointmap, cmap = 'gray')
+        plt.title("Pointmap")
+        plt.show()
+
+    #every random choice goes through one generator so a seed reproduces the drawing
+    if (seed is None):
+
+        rng = np.random
 
     else:
 
-        print("ERROR: PLEASE ENTER A VALID BACKGROUND COLOR.")
-        print("BACKGROUND COLOR REQUESTED:", bkrd_color)
+        rng = np.random.RandomState(seed)
+
+    state = _doodle_state(image, min_reach, max_reach, line_flexibility, canny_kernal_size, rng)
+
+    #report progress through a ProgressBar unless there is a hook for it
+    pbar = None
+
+    if (progress is None):
+
+        pbar = ProgressBar(maxval = lines).start()
+        progress = lambda done, total, elapsed: pbar.update(done)
+
+    #draw all of the lines
+    for edges in doodleLines(state, lines, max(1, lines // 100), progress):
+
+        continue
+
+    if (pbar is not None):
+
+        pbar.finish()
+
+    edgelist = state['edgelist']
+
+    #draw the edges
+    canvas = doodleRender(edgelist, (rows, cols), line_colors, max_line_thickness, bkrd_color, canvas_dtype, None if seed is None else rng)
+
+    if (return_edgelist):
+
+        return canvas, edgelist
+
+    #return the object :)
+    return canvas
+
+def doodleStart(path, min_reach, max_reach, line_flexibility, canny_kernal_size, seed = None):
+
+    """ Sets up a resumable doodle, to be drawn a chunk at a time with doodleLines.
+
+    Args:
+        path (str or DoodleImage): Path to the image, or an already prepared DoodleImage.
+        min_reach (float): The minimum distance that the origin of a line will search for an endpoint in pixel space.
+        max_reach (float): The maximum distance that the origin of a line will search for an endpoint in pixel space.
+        line_flexibility (float): (-1, 1). Larger positive values will encourage straight lines.
+        canny_kernal_size (int): Square kernal size for canny edge detection. Larger values will "erode" image more.
+        seed (int): Seed for a reproducible drawing. Defaults to a fresh random seed.
+
+    Returns:
+        state (dict): Everything needed to carry on drawing. It can be pickled and drawn further later.
+                      'edgelist' -> every line drawn so far, as [(source x, y), (sink x, y)] pairs
+                      'source' -> point id the next line starts from (the last endpoint), None before the first line
+                      'previous_line' -> [(row, col) source, (row, col) endpoint] of the last line, None before the first line
+                      'visits' -> the visited mask and unvisited pool of the edge points
+                      'rng' -> the numpy.random.RandomState every choice is drawn from
+                      'exhausted' -> True once no source can reach an endpoint anymore
+
+    """
+
+    if (isinstance(path, DoodleImage)):
+
+        image = path
+
+    else:
+
+        image = DoodleImage(path)
+
+    #get the number of rows and cols in the image
+    rows = np.shape(image.src)[0]
+    cols = np.shape(image.src)[1]
+
+    #check reach and flexibility conditions
+    if (not _check_search(rows, cols, min_reach, max_reach, line_flexibility)):
+
         return -1
 
+    if (np.sum(image.pointmap(canny_kernal_size)) == 0):
+
+        print("ERROR: THE POINTMAP HAS NO POINTS. TRY DECREASING KERNAL SIZE.")
+        return -1
+
+    return _doodle_state(image, min_reach, max_reach, line_flexibility, canny_kernal_size, np.random.RandomState(seed))
+
+def doodleLines(state, lines, chunk = 1000, progress = None):
+
+    """ Draws lines onto a doodle from doodleStart, yielding them a chunk at a time.
+        The state is updated as lines are drawn, so calling this again extends the same drawing.
+
+    Args:
+        state (dict): State from doodleStart
+        lines (int): The number of lines you would like to try and draw.
+        chunk (int): The number of lines in every chunk
+        progress (function): Called as progress(lines drawn, lines, seconds elapsed) after every chunk.
+
+    Returns:
+        edges (generator): Yields the list of lines drawn in every chunk, as [(source x, y), (sink x, y)] pairs.
+                           Render the drawing so far at any point with doodleRender(state['edgelist'], ...).
+
+    """
+
+    start = time.perf_counter()
+    done = 0
+
+    while (done < lines and not state['exhausted']):
+
+        edges = _draw_lines(state, min(chunk, lines - done))
+        done = done + len(edges)
+
+        if (progress is not None):
+
+            progress(done, lines, time.perf_counter() - start)
+
+        yield edges
+
+def _check_search(rows, cols, min_reach, max_reach, line_flexibility):
+
+    """ Checks the reach and flexibility conditions of a doodle, printing what is wrong """
+
     #check reach conditions
     if (min_reach == max_reach):
 
         print("ERROR: PLEASE MAKE SURE min_reach < max_reach")
-        return -1
+        return False
     
     if (min_reach > max_reach):
 
         print("ERROR: PLEASE MAKE SURE min_reach < max_reach")
-        return -1
+        return False
 
     if (min_reach > rows or min_reach > cols):
 
         print("PLEASE MAKE SURE min_reach IS LESS THAN THE SIZE OF THE IMAGE IN EITHER DIMENSION")
-        return -1
-
+        return False
 
     #check flexibility conditions
     if (line_flexibility <= -1 or line_flexibility >= 1):
@@ -78,308 +241,535 @@ def doodle(path, min_reach, max_reach, line_color, line_flexibility, number_of_l
         #equality conditions are prohibited because choosing a line "parallel" with the line previous is just silly
 
         print("ERROR: PLEASE ENTER A VALID LINE FLEXIBILITY")
-        return -1
-    
-    #choose the line color(s) that will be drawn with
-    if (line_color == 'white'):
+        return False
 
-        line_colors = (1, 1, 1)
+    return True
 
-    elif (line_color == 'black'):
+def _doodle_state(image, min_reach, max_reach, line_flexibility, canny_kernal_size, rng):
 
-        line_colors = (0, 0, 0)
+    """ Sets up the drawing state of a doodle (see doodleStart) """
 
-    elif (line_color == 'light colors' or line_color == 'dark colors'):
+    #extract the edge points once into a spatial index
+    index = image.edgeIndex(canny_kernal_size, max_reach)
 
-        #set internal private parameters for choosing colors
-        view = False 
-        hue_separation = 10
-        space = 'bgr'
+    state = {}
+    state['image'] = image
+    state['index'] = index
+    state['min_reach'] = min_reach
+    state['max_reach'] = max_reach
+    state['line_flexibility'] = line_flexibility
+    state['canny_kernal_size'] = canny_kernal_size
+    state['rng'] = rng
 
-        #make decision about what "kind" of colors
-        if (line_color == 'light colors'):
+    #instantiate storage to track the points that have been visited
+    state['visits'] = _visit_tracker(len(index['points']))
 
-            sq = 0.8
-            vq = 0.8
+    state['source'] = None
+    state['previous_line'] = None
+    state['edgelist'] = []
+    state['exhausted'] = False
 
-        elif (line_color == 'dark colors'):
+    return state
 
-            sq = 0.4
-            vq = 0.3
+def _draw_lines(state, lines):
 
-        #get the line colors
-        line_colors = color.colorPalette(path, view, number_of_line_colors, hue_separation, sq, vq, space)
+    """ Draws up to lines more lines onto a doodle state, returning the new ones """
 
-        #if we can't find the number requested, just pick the max that could be found for these parameters 
-        if (len(line_colors) != number_of_line_colors):
+    index = state['index']
+    points = index['points']
+    visits = state['visits']
+    rng = state['rng']
 
-            #generate new palette with updated number of possible colors
-            line_colors = color.colorPalette(path, view, len(line_colors), hue_separation, sq, vq, space)
+    min_reach = state['min_reach']
+    max_reach = state['max_reach']
+    line_flexibility = state['line_flexibility']
+
+    #instantiate storage for storing line coordinates
+    edgelist = []
+
+    #begin the lines loop
+    for l in range(0, lines):
+
+        #choose source for this line, picking an origin to start on for the very first line
+        if (state['source'] is None):
+
+            source_id = _random_unvisited(visits, rng)
+
+        else:
+
+            source_id = state['source']
+
+        #forbid the source, which also takes it out of the candidate pool
+        _visit(visits, source_id)
+
+        #establish endpoint storage for this line
+        jump_to_this_endpoint = []
+
+        #look for a valid endpoint
+        restarts = 0
+        while (len(jump_to_this_endpoint) == 0):
+
+            source_of_line = (int(points[source_id][0]), int(points[source_id][1]))
+
+            #get every unvisited edge point in the [min_reach, max_reach] annulus around the source
+            candidates = _annulus_candidates(index, source_of_line, min_reach, max_reach)
+            candidates = candidates[~visits['visited'][candidates]]
+
+            #in the case where we have a previous line to worry about, check the flexibility of every candidate at once
+            if (state['previous_line'] is not None):
+
+                candidates = candidates[_flexible(state['previous_line'], source_of_line, points[candidates], line_flexibility)]
+
+            #pick one of the survivors at random
+            if (len(candidates) > 0):
+
+                jump_to_this_endpoint.append(int(candidates[rng.randint(0, len(candidates))]))
+
+            #if no endpoint can be reached from this source, pick a new source elsewhere
+            if (len(jump_to_this_endpoint) == 0):
+
+                restarts = restarts + 1
+
+                #catch the case where no source can reach an endpoint anymore
+                if (restarts > visits['remaining']):
+
+                    break
+
+                source_id = _random_unvisited(visits, rng)
+
+        if (len(jump_to_this_endpoint) == 0):
+
+            print("WARNING: NO REACHABLE ENDPOINTS LEFT, STOPPING AFTER", len(state['edgelist']), "LINES.")
+            state['exhausted'] = True
+            break
+
+        #store that endpoint for the next line's source
+        state['source'] = jump_to_this_endpoint[0]
+        endpoint = (int(points[state['source']][0]), int(points[state['source']][1]))
+
+        #keep track of the line that was just drawn
+        state['previous_line'] = [source_of_line, endpoint]
+
+        #add the line that was just drawn to the edgelist (nb coordinate correction)
+        #stored as: [(source coordinate) -> (sink coordinate)]
+        edge = [(source_of_line[1], source_of_line[0]), (endpoint[1], endpoint[0])]
+        edgelist.append(edge)
+        state['edgelist'].append(edge)
+
+    return edgelist
+
+def doodleVariants(path, variants, workers = None, return_seeds = False):
+
+    """ Draws many doodles of the same image across a process pool, paying for the preprocessing once.
+
+    Args:
+        path (str or DoodleImage): Path to the image, or an already prepared DoodleImage.
+        variants (list): One dict of doodle() keyword arguments per drawing (everything after path).
+                         view_pointmap defaults to False, and progress to no progress report.
+                         A variant without a seed is given a fresh one of its own.
+        workers (int): The number of worker processes. Defaults to the number of cores.
+        return_seeds (bool): Also return the seed every variant was drawn with
+
+    Returns:
+        canvases (list): The result of doodle() for every variant, in order.
+        seeds (list): The seed of every variant (only if return_seeds), so any of them can be drawn again.
+
+    """
+
+    if (isinstance(path, DoodleImage)):
+
+        image = path
 
-            #update number of line colors
-            number_of_line_colors = len(line_colors)
-    
     else:
 
-        print("ERROR: PLEASE ENTER A VALID LINE COLOR.")
-        print("LINE COLOR REQUESTED:", line_color)
-        return -1
+        image = DoodleImage(path)
 
-    #get a binary pointmap for the image
-    pointmap = cv2.Canny(src, canny_kernal_size, canny_kernal_size) #returns points either 0 or 255
-    pointmap = pointmap / np.max(pointmap) #makes points either 0 or 1
-    pointmap = pointmap.astype(int)
+    variants = [dict({'view_pointmap': False, 'progress': _no_progress}, **variant) for variant in variants]
 
-    #see how many points are possible
-    number_of_available_points = int(np.sum(pointmap))
+    #the workers all start from a copy of the same global random state, so every
+    #unseeded variant gets a seed of its own here rather than the same drawing
+    fresh_seeds = np.random.SeedSequence().spawn(len(variants))
 
-    #because of forbidden_points enforcement, catch inundation case
-    if (lines >= number_of_available_points):
+    for variant, fresh_seed in zip(variants, fresh_seeds):
 
-        print("ERROR: NOT ENOUGH AVAILABLE POINTS TO COMPLETE LINE REQUEST.")
-        print("TRY DECREASING KERNAL SIZE OR DECREASING NUMBER OF LINES REQUESTED.")
-        print("NUMBER OF AVAILABLE POINTS:", number_of_available_points)
-        return -1
+        if (variant.get('seed') is None):
 
-    #show the pointmap if the user wants it
-    if (view_pointmap == True):
+            variant['seed'] = int(fresh_seed.generate_state(1)[0])
 
-        plt.imshow(pointmap, cmap = 'gray')
-        plt.title("Pointmap")
-        plt.show()
+    seeds = [variant['seed'] for variant in variants]
 
-    #pick an origin to start on
-    origin = []
-    while (len(origin) == 0):
-        
-        r_rand = np.random.randint(0, rows)
-        c_rand = np.random.randint(0, cols)
-        my_origin = (r_rand, c_rand)
+    #fill the caches up front so the workers only ever draw
+    for variant in variants:
 
-        my_chosen_point = pointmap[r_rand, c_rand]
+        image.pointmap(variant['canny_kernal_size'])
+        image.edgeIndex(variant['canny_kernal_size'], variant['max_reach'])
+        image.palette(variant['line_color'], variant['number_of_line_colors'])
 
-        if (my_chosen_point == 1):
+    #hand the prepared image to every worker once rather than with every variant
+    with ProcessPoolExecutor(max_workers = workers, initializer = _set_variant_image, initargs = (image,)) as pool:
 
-            origin.append(my_origin)
+        canvases = list(pool.map(_draw_variant, variants))
 
-        else:
+    if (return_seeds):
 
-            continue
+        return canvases, seeds
 
-    #set up pbar
-    pbar = ProgressBar()
+    return canvases
 
-    #instantiate storage to store points that have been visited
-    forbidden_points = []
+#the prepared image of the current doodleVariants worker
+_variant_image = [None]
 
-    #instantiate storage for storing line coordinates
-    edgelist = []
+def _set_variant_image(image):
 
-    #begin the lines loop
-    for l in pbar(range(0, lines)):
+    """ Stores the prepared image in a doodleVariants worker """
 
-        #choose source for this line
-        if (l == 0):
+    _variant_image[0] = image
 
-            source_of_line = origin[0]
+def _no_progress(done, total, elapsed):
 
-        else:
+    """ Progress hook that reports nothing, so the doodleVariants workers do not all draw progress bars """
 
-            source_of_line = previous_endpoint
+    return None
 
-        #append to forbid
-        forbidden_points.append(source_of_line)
+def _draw_variant(variant):
 
-        #establish endpoint storage for this line
-        jump_to_this_endpoint = []
+    """ Draws one doodleVariants variant from the worker's prepared image """
 
-        #look for a valid endpoint
-        ticker = 0
-        while (len(jump_to_this_endpoint) == 0):
+    return doodle(_variant_image[0], **variant)
 
-            ticker = ticker + 1
+class DoodleImage:
 
-            #if we search for an endpoint for t = size of max reach block, pick a new source elsewhere
-            if (ticker == (max_reach * max_reach)):
+    """ An image prepared for doodling, caching everything doodle() derives from it.
 
-                #pick a new source
-                source_of_line_storage = []
-                while (len(source_of_line_storage) == 0):
-                    
-                    #choose new random coordinate
-                    r_rand = np.random.randint(0, rows)
-                    c_rand = np.random.randint(0, cols)
-                    my_source_of_line = (r_rand, c_rand)
+    The grayscale image is read once. Pointmaps, edge indexes and line color palettes are
+    computed the first time they are asked for and reused by every later doodle.
 
-                    #get pointmap value (zero or one)
-                    my_chosen_point = pointmap[r_rand, c_rand]
+    Args:
+        path (str): Path to the image.
 
-                    #if it's one, pick it
-                    if (my_chosen_point == 1):
+    """
 
-                        source_of_line_storage.append(my_source_of_line)
-                        source_of_line = source_of_line_storage[0]
-                        ticker = 0 #this line is very very important, resets ticker!
+    def __init__(self, path):
 
-                    #else, keep searching
-                    else:
+        self.path = path
 
-                        continue
+        #read in image as grayscale
+        self.src = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
 
-            #get random coordinate limits (within max_reach range)
-            upper_row_coord = source_of_line[0] - max_reach
-            lower_row_coord = source_of_line[0] + max_reach
-            left_col_coord = source_of_line[1] - max_reach
-            right_col_coord = source_of_line[1] + max_reach
+        self._pointmaps = {}
+        self._edge_indexes = {}
+        self._palettes = {}
 
-            #check conditions for saftey against core dump
-            if (upper_row_coord < 0):
+    def pointmap(self, canny_kernal_size):
 
-                upper_row_coord = 0
+        """ Binary (0 or 1) Canny pointmap of the image """
 
-            if (lower_row_coord > rows):
+        if (canny_kernal_size not in self._pointmaps):
 
-                lower_row_coord = rows
+            pointmap = cv2.Canny(self.src, canny_kernal_size, canny_kernal_size) #returns points either 0 or 255
+            self._pointmaps[canny_kernal_size] = (pointmap == 255).astype(int) #makes points either 0 or 1
 
-            if (left_col_coord < 0):
+        return self._pointmaps[canny_kernal_size]
 
-                left_col_coord = 0
+    def edgeIndex(self, canny_kernal_size, max_reach):
 
-            if (right_col_coord > cols):
+        """ Grid index of the pointmap's edge points for searches up to max_reach """
 
-                right_col_coord = cols
+        key = (canny_kernal_size, max_reach)
 
-            #get the random coordinate inside of that search range
-            random_row_coordinate = np.random.randint(upper_row_coord, lower_row_coord)
-            random_col_coordinate = np.random.randint(left_col_coord, right_col_coord)
+        if (key not in self._edge_indexes):
 
-            #create random coordinate tuple
-            my_random_endpoint_coordinate = (random_row_coordinate, random_col_coordinate)
+            self._edge_indexes[key] = _edge_index(self.pointmap(canny_kernal_size), max_reach)
 
-            #create storage for the random line under inspection [source -> endpoint]
-            my_random_line = [source_of_line, my_random_endpoint_coordinate]
+        return self._edge_indexes[key]
 
-            #in the case where we don't have a previous line to worry about
-            if (l == 0):
+    def palette(self, line_color, number_of_line_colors):
 
-                #if we have visited this already, move on
-                if (my_random_endpoint_coordinate in forbidden_points):
+        """ BGR line colors in range [0:255] for a doodle line_color, None if line_color is invalid """
 
-                    continue
+        key = (line_color, number_of_line_colors)
 
-                #get distance of random point from source of line
-                dist = np.sqrt(np.square(source_of_line[0] - random_row_coordinate) + np.square(source_of_line[1] - random_col_coordinate))
-                
-                #get the value of that point at that random coordinate (zero or one)
-                pointmap_value = pointmap[random_row_coordinate, random_col_coordinate]
+        if (key in self._palettes):
 
-                #if the point is one and fulfills reach requirements
-                if (pointmap_value == 1 and dist >= min_reach and dist <= max_reach):
+            return self._palettes[key]
 
-                    jump_to_this_endpoint.append(my_random_endpoint_coordinate)
+        if (line_color == 'white'):
 
-                #else, keep searching
-                else:
+            line_colors = [(255, 255, 255)]
 
-                    continue
+        elif (line_color == 'black'):
 
-            else:
+            line_colors = [(0, 0, 0)]
 
-                #if we have visited this already, move on
-                if (my_random_endpoint_coordinate in forbidden_points):
+        elif (line_color == 'light colors' or line_color == 'dark colors'):
 
-                    continue
+            #set internal private parameters for choosing colors
+            view = False
+            hue_separation = 10
+            space = 'bgr'
 
-                #get bias
-                my_bias_x = my_previous_line[0][0] - my_previous_line[1][0]
-                my_bias_y = my_previous_line[0][1] - my_previous_line[1][1]
-                my_bias = (my_bias_x, my_bias_y)
+            #make decision about what "kind" of colors
+            if (line_color == 'light colors'):
 
-                #add bias to each of the random line coordinates to get same origin for dot product
-                my_random_line_biased_source = (my_random_line[0][0] + my_bias[0], my_random_line[0][1] + my_bias[1])
-                my_random_line_biased_endpoint = (my_random_line[1][0] + my_bias[0], my_random_line[1][1] + my_bias[1])
-                my_random_line_biased = (my_random_line_biased_source, my_random_line_biased_endpoint)
+                sq = 0.8
+                vq = 0.8
 
-                #set up vectors for dot product
-                my_previous_line_vector = np.array([my_previous_line[1][1] - my_previous_line[0][1], my_previous_line[0][0] - my_previous_line[1][0]])
-                my_random_line_biased_vector = np.array([my_random_line_biased[1][1] - my_random_line_biased[0][1], my_random_line_biased[0][0] - my_random_line_biased[1][0]])
+            elif (line_color == 'dark colors'):
 
-                #max normalize each of the vectors to make them unit
-                my_previous_line_vector_magnitude =  np.sqrt(np.sum(np.square(my_previous_line_vector)))
-                my_random_line_biased_vector_magnitude =  np.sqrt(np.sum(np.square(my_random_line_biased_vector)))
+                sq = 0.4
+                vq = 0.3
 
-                #catch for divide by zero error
-                if (my_previous_line_vector_magnitude == 0 or my_random_line_biased_vector_magnitude == 0):
+            #get the line colors
+            line_colors = color.colorPalette(self.path, view, number_of_line_colors, hue_separation, sq, vq, space)
 
-                    continue
+            #if we can't find the number requested, just pick the max that could be found for these parameters
+            if (len(line_colors) != number_of_line_colors):
 
-                my_previous_line_vector_mn = my_previous_line_vector / my_previous_line_vector_magnitude
-                my_random_line_biased_vector_mn = my_random_line_biased_vector / my_random_line_biased_vector_magnitude
+                #generate new palette with updated number of possible colors
+                line_colors = color.colorPalette(self.path, view, len(line_colors), hue_separation, sq, vq, space)
 
-                #find the dot product
-                my_dot_product_value = np.dot(my_previous_line_vector_mn, my_random_line_biased_vector_mn)
+        else:
 
-                #get distance of random point from source of line
-                dist = np.sqrt(np.square(source_of_line[0] - random_row_coordinate) + np.square(source_of_line[1] - random_col_coordinate))
-                
-                #get the value of that point at that random coord (should be 0 or 1)
-                pointmap_value = pointmap[random_row_coordinate, random_col_coordinate]
+            return None
 
-                #if the point is one and fulfills reach requirements and fulfills dot product requirements
-                if (pointmap_value == 1 and dist >= min_reach and dist <= max_reach and my_dot_product_value >= line_flexibility):
+        self._palettes[key] = line_colors
 
-                    jump_to_this_endpoint.append(my_random_endpoint_coordinate)
+        return line_colors
 
-                #else, keep searching
-                else:
+def doodleRender(edgelist, shape, line_colors, max_line_thickness, bkrd_color, canvas_dtype = np.float64, seed = None):
 
-                    continue
+    """ Draws the lines of a doodle, so the same geometry can be re-rendered in different styles.
 
-        #store that endpoint for the next line's source
-        previous_endpoint = jump_to_this_endpoint[0]
+    Details: Lines cycle through line_colors in edgelist order and get a random thickness in
+             [1, max_line_thickness). Every line sharing a color and thickness is then drawn
+             with one cv2.polylines call.
 
-        #create storage for the next loop that keeps track of the line that was just drawn
-        my_previous_line = [source_of_line, jump_to_this_endpoint[0]]
+    Args:
+        edgelist (list): The lines as [(source x, y), (sink x, y)] pairs, as returned by doodle(..., return_edgelist = True)
+        shape (tuple): (rows, cols) of the canvas
+        line_colors (list): BGR colors in range [0:255] to cycle through, e.g. [(255, 255, 255)] for white lines
+        max_line_thickness (int): The maximum thickness of the line in units of pixels.
+        bkrd_color (str): {'white', 'black'} What color the background should be.
+        canvas_dtype (type): {np.float64, np.uint8} Draw on a float canvas in range [0:1] or a uint8 canvas in range [0:255].
+        seed (int or numpy.random.RandomState): Seed for reproducible thicknesses. Defaults to numpy's global random state.
 
-        #add the line that was just drawn to the edgelist (nb coordinate correction)
-        #stored as: [(source coordinate) -> (sink coordinate)]
-        edgelist.append([(source_of_line[1], source_of_line[0]), (jump_to_this_endpoint[0][1], jump_to_this_endpoint[0][0])])
-        
-   
-    #set up counter for color looping
-    color_counter = 0
+    Returns:
+        canvas (numpy.ndarray): The drawing.
 
-    #draw the edges
-    for edge in edgelist:
+    """
 
-        #reset color counter when it reaches limit
-        if (color_counter == number_of_line_colors):
+    #uint8 normalize to make agreeable with the canvas, once for every color
+    if (np.dtype(canvas_dtype) == np.uint8):
 
-            color_counter = 0
+        scale = 255
+        colors = [tuple(int(v) for v in bgr_value) for bgr_value in line_colors]
 
-        #if the line is black or white
-        if (line_color == 'white' or line_color == 'black'):
+    else:
 
-            #draw the line and reassign canvas
-            cv2.line(canvas, edge[0], edge[1], line_colors, thickness = np.random.randint(1, max_line_thickness))
+        scale = 1
+        colors = [tuple(v / 255 for v in bgr_value) for bgr_value in line_colors]
 
-        #if we want to cycle through the colors 
-        elif (line_color == 'dark colors' or line_color == 'light colors'):
+    #set up the background canvas that will be drawn on
+    if (bkrd_color == 'white'):
 
-            #get the current bgr value
-            bgr_value = line_colors[color_counter]
-            
-            #uint8 normalize to make agreeable with cv2.line()
-            b_norm = bgr_value[0] / 255
-            g_norm = bgr_value[1] / 255
-            r_norm = bgr_value[2] / 255
-            bgr_value_norm = (b_norm, g_norm, r_norm)
+        canvas = np.full((shape[0], shape[1], 3), scale, dtype = canvas_dtype)
 
-            #draw the line and reassign canvas
-            cv2.line(canvas, edge[0], edge[1], bgr_value_norm, thickness = np.random.randint(1, max_line_thickness))
+    elif (bkrd_color == 'black'):
 
-        #++ the colorcounter
-        color_counter = color_counter + 1
+        canvas = np.zeros((shape[0], shape[1], 3), dtype = canvas_dtype)
+
+    else:
+
+        print("ERROR: PLEASE ENTER A VALID BACKGROUND COLOR.")
+        print("BACKGROUND COLOR REQUESTED:", bkrd_color)
+        return -1
+
+    if (len(edgelist) == 0):
+
+        return canvas
+
+    segments = np.asarray(edgelist, dtype = np.int32).reshape(-1, 2, 2)
+
+    #cycle through the colors and pick every thickness up front
+    color_index = np.arange(0, len(segments)) % len(colors)
+    if (seed is None):
+
+        rng = np.random
+
+    elif (isinstance(seed, np.random.RandomState)):
+
+        rng = seed
+
+    else:
+
+        rng = np.random.RandomState(seed)
+
+    thickness = rng.randint(1, max_line_thickness, size = len(segments))
+
+    #draw every line of a color and thickness at once
+    group = (color_index * max_line_thickness) + thickness
+
+    for g in np.unique(group):
+
+        members = segments[group == g]
+        cv2.polylines(canvas, list(members), False, colors[g // max_line_thickness], thickness = int(g % max_line_thickness))
 
-    #return the object :)
     return canvas
+
+def _edge_index(pointmap, max_reach):
+
+    """ Buckets the edge points of a pointmap into a grid of max_reach sized cells.
+
+    Args:
+        pointmap (numpy.ndarray): Binary (0 or 1) pointmap
+        max_reach (float): The maximum distance that will ever be searched from a source
+
+    Returns:
+        index (dict): 'points' -> (points, 2) row, col coordinates of every edge point, sorted by cell
+                      'starts' -> offset into points of the first point in every cell (plus one past the end)
+                      'cell' -> side length of a cell
+                      'grid_rows', 'grid_cols' -> the number of cells down and across
+
+    """
+
+    rows = np.shape(pointmap)[0]
+    cols = np.shape(pointmap)[1]
+
+    cell = max(1, int(np.ceil(max_reach)))
+    grid_rows = (rows // cell) + 1
+    grid_cols = (cols // cell) + 1
+
+    points = np.argwhere(pointmap == 1)
+
+    #sort the points by the cell they fall in so every cell is one contiguous slice
+    bucket = ((points[:, 0] // cell) * grid_cols) + (points[:, 1] // cell)
+    order = np.argsort(bucket, kind = 'stable')
+
+    index = {}
+    index['points'] = points[order]
+    index['starts'] = np.searchsorted(bucket[order], np.arange(0, (grid_rows * grid_cols) + 1))
+    index['cell'] = cell
+    index['grid_rows'] = grid_rows
+    index['grid_cols'] = grid_cols
+
+    return index
+
+def _annulus_candidates(index, source, min_reach, max_reach):
+
+    """ Returns the ids (positions in index['points']) of the edge points whose distance from source is in [min_reach, max_reach] """
+
+    cell = index['cell']
+
+    #the reach only spans the cells next to the source's cell
+    top = max(0, int(source[0] - max_reach) // cell)
+    bottom = min(index['grid_rows'] - 1, int(source[0] + max_reach) // cell)
+    left = max(0, int(source[1] - max_reach) // cell)
+    right = min(index['grid_cols'] - 1, int(source[1] + max_reach) // cell)
+
+    #the cells of one grid row are contiguous in the sorted points
+    ids = []
+
+    for grid_row in range(top, bottom + 1):
+
+        first = index['starts'][(grid_row * index['grid_cols']) + left]
+        last = index['starts'][(grid_row * index['grid_cols']) + right + 1]
+        ids.append(np.arange(first, last))
+
+    ids = np.concatenate(ids)
+
+    offsets = index['points'][ids] - np.asarray(source)
+    squared_distance = np.sum(np.square(offsets), axis = 1)
+
+    return ids[(squared_distance >= min_reach * min_reach) & (squared_distance <= max_reach * max_reach)]
+
+def _visit_tracker(number_of_points):
+
+    """ Tracks visited edge points by id with a visited mask and a pool of the unvisited ids.
+
+    Details: The pool keeps the unvisited ids in its first 'remaining' slots, and 'position' says
+             where every id sits in the pool, so a point is removed by swapping it with the last
+             unvisited id. Lookups, visits and random picks are all constant time.
+
+    """
+
+    visits = {}
+    visits['visited'] = np.zeros(number_of_points, dtype = bool)
+    visits['pool'] = np.arange(0, number_of_points)
+    visits['position'] = np.arange(0, number_of_points)
+    visits['remaining'] = number_of_points
+
+    return visits
+
+def _visit(visits, point_id):
+
+    """ Marks a point as visited and takes it out of the unvisited pool """
+
+    if (visits['visited'][point_id]):
+
+        return
+
+    visits['visited'][point_id] = True
+
+    pool = visits['pool']
+    position = visits['position']
+
+    #swap the point with the last unvisited id, then shrink the pool
+    last = visits['remaining'] - 1
+    here = position[point_id]
+    moved = pool[last]
+
+    pool[here] = moved
+    position[moved] = here
+    pool[last] = point_id
+    position[point_id] = last
+
+    visits['remaining'] = last
+
+def _random_unvisited(visits, rng):
+
+    """ Picks a random unvisited point id (any point if every point has been visited) """
+
+    if (visits['remaining'] == 0):
+
+        return rng.randint(0, len(visits['pool']))
+
+    return int(visits['pool'][rng.randint(0, visits['remaining'])])
+
+def _flexible(previous_line, source, endpoints, line_flexibility):
+
+    """ Checks which of the lines source -> endpoints bend little enough from previous_line.
+
+    Details: The lines are moved to a common origin and turned into unit vectors (x right, y up),
+             and their dot product with the previous line has to be at least line_flexibility.
+             Degenerate lines fail.
+
+    Args:
+        previous_line (list): [(row, col) source, (row, col) endpoint] of the previous line
+        source (tuple): (row, col) source of the new line
+        endpoints (numpy.ndarray): (candidates, 2) row, col coordinates of the candidate endpoints
+        line_flexibility (float): (-1, 1). The smallest allowed dot product.
+
+    Returns:
+        flexible (numpy.ndarray): Boolean mask over the candidates
+
+    """
+
+    #set up vectors for dot product
+    previous_x = previous_line[1][1] - previous_line[0][1]
+    previous_y = previous_line[0][0] - previous_line[1][0]
+    random_x = endpoints[:, 1] - source[1]
+    random_y = source[0] - endpoints[:, 0]
+
+    #max normalize each of the vectors to make them unit
+    previous_magnitude = np.sqrt((previous_x * previous_x) + (previous_y * previous_y))
+    random_magnitude = np.sqrt((random_x * random_x) + (random_y * random_y))
+
+    #catch for divide by zero error
+    if (previous_magnitude == 0):
+
+        return np.zeros(len(endpoints), dtype = bool)
+
+    #find the dot products, compared without dividing so degenerate lines just fail
+    dot_product = (previous_x * random_x) + (previous_y * random_y)
+
+    return (random_magnitude > 0) & (dot_product >= line_flexibility * previous_magnitude * random_magnitude)
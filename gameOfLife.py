@@ -1,7 +1,19 @@
+import os
+import re
+import multiprocessing
+from functools import lru_cache
+from multiprocessing import shared_memory
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
 
+#fate of a cell, indexed [current value, living neighbors]
+#a dead cell is revived by exactly three neighbors, a living cell survives with two or three
+CONWAY = np.zeros((2, 9), dtype = np.uint8)
+CONWAY[0, 3] = 1
+CONWAY[1, 2] = 1
+CONWAY[1, 3] = 1
+
 def gameOfLife(path, generations):
 
     """ Runs Conway's Game of Life on a binary grayscale (single channel) image.
@@ -9,118 +21,929 @@ def gameOfLife(path, generations):
     Args:
         path (str): Path to the image. The image will be generation zero.
         generations (int): How many generations you want to run, not including the zero generation.
-            
+
     Returns:
         life (list): All of the generations for this image. (zero -> generations)
                      Each element in this list will be a 2D numpy array that is
                      the same size as the image that was ingested.
                      Element zero will be generation zero, element one will be
                      the first generation, etc...
-                     Each of these images will also be binary and have 
+                     Each of these images will also be binary (uint8) and have
                      range [0:1].
 
     """
 
-    #read in image as grayscale
-    src = cv2.imread(path, cv2.IMREAD_GRAYSCALE) 
+    current_generation = _read_board(path)
 
-    #normalize image to range [0:1] (assuming 8-bit image)
-    src_norm = src / 255
+    #catch nonbinary issue once, up front
+    if (current_generation is None):
 
-    #get the rows, cols, chans in the image
-    rows = np.shape(src)[0]
-    cols = np.shape(src)[1]
+        print("ERROR: PLEASE PROVIDE A BINARY IMAGE")
+        return -1
 
     #instantiate storage for life
     life = []
 
-    #append generation zero (the original image)
-    life.append(src_norm)
+    for g, board in _generations(current_generation, generations, 1, False):
+
+        #append this generation to life
+        life.append(board)
+
+    return life
+
+def lifeGenerations(path, generations, keep_every = 1, packed = False):
+
+    """ Lazily runs Conway's Game of Life, yielding generations one at a time instead of keeping them all.
+
+    Args:
+        path (str or numpy.ndarray): Path to a binary image, or an already loaded binary (0 or 1) board
+        generations (int): How many generations you want to run, not including the zero generation.
+        keep_every (int): Only yield every keep_every-th generation (generation zero is always yielded)
+        packed (bool): Step and yield bit-packed boards (see packBoard) instead of uint8 boards
+
+    Returns:
+        life (generator): Yields (generation number, board) pairs
+
+    """
+
+    board = _read_board(path)
+
+    #catch nonbinary issue once, up front
+    if (board is None):
+
+        print("ERROR: PLEASE PROVIDE A BINARY IMAGE")
+        return -1
+
+    if (keep_every < 1):
+
+        print("ERROR: PLEASE ENTER A VALID keep_every")
+        return -1
+
+    return _generations(board, generations, keep_every, packed)
 
-    for g in range(0,generations):
+def lifeRecord(path, generations, dst_path, keep_every = 1, packed = False, fps = 30):
 
-        print(g)
+    """ Runs Conway's Game of Life and writes the generations straight to disk, holding only one at a time.
 
-        #create empty array to store the next generation in
-        next_generation = np.zeros((rows, cols))
+    Args:
+        path (str or numpy.ndarray): Path to a binary image, or an already loaded binary (0 or 1) board
+        generations (int): How many generations you want to run, not including the zero generation.
+        dst_path (str): Where to write the generations. A .npy path is written as a memory-mapped
+                        (frames, rows, cols) uint8 stack, anything else as a video through cv2.VideoWriter.
+        keep_every (int): Only write every keep_every-th generation (generation zero is always written)
+        packed (bool): Write a (frames, rows, words) stack of bit-packed boards to the .npy instead (see packBoard)
+        fps (int): Frame rate of the video
+
+    Returns:
+        frames (int): The number of generations written
+
+    """
+
+    board = _read_board(path)
+
+    #catch nonbinary issue once, up front
+    if (board is None):
+
+        print("ERROR: PLEASE PROVIDE A BINARY IMAGE")
+        return -1
+
+    if (keep_every < 1):
+
+        print("ERROR: PLEASE ENTER A VALID keep_every")
+        return -1
+
+    #get the rows, cols in the board
+    rows = np.shape(board)[0]
+    cols = np.shape(board)[1]
 
-        #if generation zero, the current generation must be the original
-        if (g == 0):
+    life = _generations(board, generations, keep_every, packed)
 
-            current_generation = src_norm
+    frames = (generations // keep_every) + 1
+
+    if (dst_path.endswith('.npy')):
+
+        if (packed):
+
+            shape = (frames, rows, -(-cols // 64))
+            dtype = np.uint64
 
-        #else, the current generation will be the previous generation
         else:
 
-            current_generation = previous_generation
+            shape = (frames, rows, cols)
+            dtype = np.uint8
 
-        for r in range(1,rows-1):
-            
-            for c in range(1,cols-1):
-                
-                #get the current pixel value
-                current_value = current_generation[r,c]
+        stack = np.lib.format.open_memmap(dst_path, mode = 'w+', dtype = dtype, shape = shape)
 
-                #catch nonbinary issue
-                if (current_value != 1 and current_value != 0):
+        for frame, (g, board) in enumerate(life):
 
-                    print("ERROR: PLEASE PROVIDE A BINARY IMAGE")
-                    return -1
+            stack[frame] = board
 
-                #get neighbor information
-                n1 = current_generation[r-1, c-1]
-                n2 = current_generation[r-1, c  ]
-                n3 = current_generation[r-1, c+1]
-                n4 = current_generation[r  , c-1]
-                n5 = current_generation[r  , c+1]
-                n6 = current_generation[r+1, c-1]
-                n7 = current_generation[r+1, c  ]
-                n8 = current_generation[r+1, c+1]
-                neighbors = [n1, n2, n3, n4, n5, n6, n7, n8]
-                
-                #get the number of neigbors that are alive
-                living_neighbors = int(sum(neighbors))
+        stack.flush()
 
-                #if the cell is alive
-                if (current_value == 1):
+        return frames
 
-                    #account for death by underpopulation
-                    if (living_neighbors < 2):
-                
-                        fate = 0.0
+    if (packed):
 
-                    #account for the survival case
-                    elif (living_neighbors == 2 or living_neighbors == 3):
+        print("ERROR: BIT-PACKED GENERATIONS CAN ONLY BE WRITTEN TO A .npy FILE")
+        return -1
 
-                        fate = 1.0
+    if (dst_path.endswith('.avi')):
 
-                    #account for death by overpopulation
-                    elif (living_neighbors > 3):
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
 
-                        fate = 0.0
+    else:
 
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
 
-                #if the cell is dead
-                elif (current_value == 0):
+    video = cv2.VideoWriter(dst_path, fourcc, fps, (cols, rows), False)
 
+    for g, board in life:
 
-                    #account for revivial case
-                    if (living_neighbors == 3):
+        video.write(board * np.uint8(255))
 
-                        fate = 1.0
+    video.release()
 
-                    #else, remain dead
-                    else:
+    return frames
 
-                        fate = 0.0
+def lifeRun(path, generations, tile = 64):
 
+    """ Runs Conway's Game of Life, only re-evaluating the parts of the board that can still change,
+        and stops early once the board settles into a still life or an oscillator.
 
-                next_generation[r,c] = fate
+    Details: The board is split into tile x tile blocks. A block is only re-evaluated if it, or one
+             of its eight neighboring blocks, changed in the previous generation, and the whole
+             board is stepped at once whenever that would be cheaper. Every generation is also
+             hashed, only rehashing the parts of the board that changed. When a board repeats, the
+             run has entered a cycle of period P, so the remaining generations are fast-forwarded
+             by only stepping (remaining % P) more times.
 
-        #append this generation to life
-        life.append(next_generation)
+    Args:
+        path (str or numpy.ndarray): Path to a binary image, or an already loaded binary (0 or 1) board
+        generations (int): How many generations you want to run, not including the zero generation.
+        tile (int): Size of the square blocks that are tracked for changes
 
-        #store the recently updated generation as previous to operate on in the next generation
-        previous_generation = next_generation
+    Returns:
+        result (dict): 'board' -> the board at the final generation (uint8, range [0:1])
+                       'period' -> the period of the detected cycle (1 for a still life), None if no cycle was found
+                       'cycle_start' -> the first generation of the detected cycle, None if no cycle was found
+                       'steps' -> the number of generations that were actually computed
 
-    return life
+    """
+
+    board = _read_board(path)
+
+    #catch nonbinary issue once, up front
+    if (board is None):
+
+        print("ERROR: PLEASE PROVIDE A BINARY IMAGE")
+        return -1
+
+    if (tile < 1):
+
+        print("ERROR: PLEASE ENTER A VALID TILE SIZE")
+        return -1
+
+    #get the rows, cols in the board
+    rows = np.shape(board)[0]
+    cols = np.shape(board)[1]
+
+    tile_rows = -(-rows // tile)
+    tile_cols = -(-cols // tile)
+
+    #alongside its cells, the board is kept packed into 64 cell words, and the digest is the xor of a keyed
+    #hash of every word, so a generation only has to rehash the words that changed
+    words_per_row = -(-(tile_cols * tile) // 64)
+
+    #the board padded out to whole tiles and whole words
+    height = tile_rows * tile
+    width = words_per_row * 64
+
+    #pad the board with a dead ring so every tile can be sliced with its one cell halo
+    #the two generations are double buffered, so a sparse step only writes its active tiles
+    current_generation = np.zeros((height + 2, width + 2), dtype = np.uint8)
+    current_generation[1:rows+1, 1:cols+1] = board
+    next_generation = np.copy(current_generation)
+
+    #which cells may be alive, i.e. not on the border of the board or past its edge, tile by tile
+    alive = np.zeros((height, tile_cols * tile), dtype = np.uint8)
+    alive[1:rows-1, 1:cols-1] = 1
+    alive = _tiles(alive, tile, 0, tile_rows, tile_cols)
+
+    words = _pack_words(current_generation[1:height+1, 1:width+1], words_per_row)
+    keys = _word_keys(np.shape(words))
+    digest = _words_digest(keys, words)
+
+    #the words that every column of tiles overlaps
+    first_word = (np.arange(tile_cols) * tile) // 64
+    last_word = ((np.arange(1, tile_cols + 1) * tile) - 1) // 64
+
+    overlap = np.zeros((tile_cols, words_per_row), dtype = np.uint8)
+
+    for tc in range(0, tile_cols):
+
+        overlap[tc, first_word[tc]:last_word[tc]+1] = 1
+
+    #every tile has to be evaluated in the first generation
+    changed = np.ones((tile_rows, tile_cols), dtype = np.uint8)
+
+    seen = {digest: 0}
+
+    period = None
+    cycle_start = None
+    steps = 0
+    g = 0
+
+    while (g < generations):
+
+        #once most of the board is active, a whole board step is cheaper
+        dense = np.count_nonzero(changed) > (tile_rows * tile_cols) // 2
+
+        if (not dense):
+
+            #a tile can only change if something within one tile of it changed
+            active = cv2.dilate(changed, np.ones((3, 3), dtype = np.uint8), borderType = cv2.BORDER_CONSTANT, borderValue = 0)
+            active_rows, active_cols = np.nonzero(active)
+
+            dense = len(active_rows) > (tile_rows * tile_cols) // 2
+
+        if (dense):
+
+            next_generation = _fates(current_generation)
+
+            #leave the padding and the border dead
+            next_generation[0:2, :] = 0
+            next_generation[rows:, :] = 0
+            next_generation[:, 0:2] = 0
+            next_generation[:, cols:] = 0
+
+            next_words = _pack_words(next_generation[1:height+1, 1:width+1], words_per_row)
+
+            #a tile changed if any word it overlaps changed (a word shared by two tiles flags both)
+            different = next_words != words
+            word_changed = different.reshape(tile_rows, tile, words_per_row).max(axis = 1)
+            changed = (np.maximum.reduceat(word_changed, first_word, axis = 1) | word_changed[:, last_word]).astype(np.uint8)
+
+            #rehash only the words that changed, unless that is most of them
+            if (np.count_nonzero(different) > np.size(different) // 4):
+
+                digest = _words_digest(keys, next_words)
+
+            else:
+
+                digest = digest ^ _words_digest(keys[:, different], words[different]) ^ _words_digest(keys[:, different], next_words[different])
+
+            words = next_words
+
+        else:
+
+            #stack the active tiles (with their halos) on top of each other and step them all at once.
+            #the halo rows keep the stacked tiles from seeing each other, and are thrown away after.
+            neighborhoods = _tiles(current_generation, tile, 2, tile_rows, tile_cols)[active_rows, active_cols]
+            stacked = neighborhoods.reshape(len(active_rows) * (tile + 2), tile + 2)
+
+            blocks = _fates(stacked).reshape(len(active_rows), tile + 2, tile + 2)[:, 1:-1, 1:-1]
+            blocks = blocks * alive[active_rows, active_cols]
+
+            #a tile that is not active did not change last generation either, so the
+            #older generation still in next_generation already holds it
+            _tiles(next_generation[1:, 1:], tile, 0, tile_rows, tile_cols)[active_rows, active_cols] = blocks
+
+            changed = np.zeros((tile_rows, tile_cols), dtype = np.uint8)
+            changed[active_rows, active_cols] = np.any(blocks != neighborhoods[:, 1:-1, 1:-1], axis = (1, 2))
+
+            #repack and rehash only the words that the changed tiles overlap
+            dirty = np.repeat(np.matmul(changed, overlap) > 0, tile, axis = 0)
+            dirty_rows, dirty_words = np.nonzero(dirty)
+
+            cells = next_generation[1:height+1, 1:width+1].reshape(height, words_per_row, 64)[dirty_rows, dirty_words]
+            new_words = np.packbits(cells, axis = 1).view(np.uint64).ravel()
+
+            digest = digest ^ _words_digest(keys[:, dirty_rows, dirty_words], words[dirty_rows, dirty_words]) ^ _words_digest(keys[:, dirty_rows, dirty_words], new_words)
+            words[dirty_rows, dirty_words] = new_words
+
+        current_generation, next_generation = next_generation, current_generation
+        steps = steps + 1
+        g = g + 1
+
+        #a repeated board means the rest of the run is a cycle, so skip all of its whole periods
+        if (digest in seen):
+
+            cycle_start = seen[digest]
+            period = g - cycle_start
+
+            for remaining in range(0, (generations - g) % period):
+
+                current_generation[1:rows+1, 1:cols+1] = lifeStep(current_generation[1:rows+1, 1:cols+1])
+                steps = steps + 1
+
+            break
+
+        seen[digest] = g
+
+    result = {}
+    result['board'] = np.ascontiguousarray(current_generation[1:rows+1, 1:cols+1])
+    result['period'] = period
+    result['cycle_start'] = cycle_start
+    result['steps'] = steps
+
+    return result
+
+def _tiles(padded, tile, halo, tile_rows, tile_cols):
+
+    """ Views a board as a (tile_rows, tile_cols, tile + halo, tile + halo) grid of overlapping tiles """
+
+    row_stride, col_stride = padded.strides
+
+    return np.lib.stride_tricks.as_strided(padded, shape = (tile_rows, tile_cols, tile + halo, tile + halo), strides = (tile * row_stride, tile * col_stride, row_stride, col_stride))
+
+def _pack_words(cells, words_per_row):
+
+    """ Packs every row of a 0/1 board into words_per_row 64 bit words """
+
+    packed = np.zeros((np.shape(cells)[0], words_per_row * 8), dtype = np.uint8)
+
+    bits = np.packbits(cells, axis = 1)
+    packed[:, :np.shape(bits)[1]] = bits
+
+    return packed.view(np.uint64)
+
+def _mix(z):
+
+    """ splitmix64 finalizer, scrambling every bit of a uint64 array into every other bit """
+
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+
+    return z ^ (z >> np.uint64(31))
+
+def _word_keys(shape):
+
+    """ Two lanes of pseudo random 64 bit keys, one key per word position of a packed board """
+
+    positions = np.arange(np.prod(shape), dtype = np.uint64).reshape(shape)
+
+    return np.stack([_mix(positions * np.uint64(0x9E3779B97F4A7C15)), _mix(positions * np.uint64(0xD1B54A32D192ED03) + np.uint64(1))])
+
+def _words_digest(keys, words):
+
+    """ Xors together the 128 bit keyed hashes of a block of packed words """
+
+    low = np.bitwise_xor.reduce(_mix(keys[0] ^ words), axis = None)
+    high = np.bitwise_xor.reduce(_mix(keys[1] ^ words), axis = None)
+
+    return int(low) | (int(high) << 64)
+
+def lifeParallel(path, generations, workers = None, wrap = False):
+
+    """ Runs Conway's Game of Life with the board split into horizontal strips, one worker process per strip.
+
+    Details: Both the current and the next generation live in shared memory. Every generation, each
+             worker reads its strip plus the one row above and below it (the halo rows owned by its
+             neighbors), writes its strip of the next generation, and waits at a barrier for the
+             others before the two boards swap roles.
+
+    Args:
+        path (str or numpy.ndarray): Path to a binary image, or an already loaded binary (0 or 1) board
+        generations (int): How many generations you want to run, not including the zero generation.
+        workers (int): The number of worker processes. Defaults to the number of cores.
+        wrap (bool): Wrap the board around into a torus. Otherwise the border of the board is left dead.
+
+    Returns:
+        board (numpy.ndarray): The board at the final generation (uint8, range [0:1])
+
+    """
+
+    board = _read_board(path)
+
+    #catch nonbinary issue once, up front
+    if (board is None):
+
+        print("ERROR: PLEASE PROVIDE A BINARY IMAGE")
+        return -1
+
+    #get the rows, cols in the board
+    rows = np.shape(board)[0]
+    cols = np.shape(board)[1]
+
+    if (workers is None):
+
+        workers = os.cpu_count() or 1
+
+    #every worker needs at least one row
+    workers = max(1, min(workers, rows))
+
+    if (workers == 1):
+
+        for g in range(0, generations):
+
+            board = lifeStep(board, wrap)
+
+        return board
+
+    #double buffered boards in shared memory
+    memory = [shared_memory.SharedMemory(create = True, size = rows * cols) for b in range(0, 2)]
+
+    try:
+
+        np.ndarray((rows, cols), dtype = np.uint8, buffer = memory[0].buf)[:] = board
+
+        barrier = multiprocessing.Barrier(workers)
+        bounds = np.linspace(0, rows, workers + 1).astype(int)
+
+        processes = []
+
+        for w in range(0, workers):
+
+            args = ([m.name for m in memory], (rows, cols), bounds[w], bounds[w+1], generations, wrap, barrier)
+            process = multiprocessing.Process(target = _strip_worker, args = args)
+            process.start()
+            processes.append(process)
+
+        #if a worker dies, break the barrier so the others don't wait on it forever
+        failed = False
+
+        while (any(process.is_alive() for process in processes)):
+
+            for process in processes:
+
+                process.join(timeout = 0.1)
+
+                if (process.exitcode not in (None, 0) and not failed):
+
+                    failed = True
+                    barrier.abort()
+
+        if (failed or any(process.exitcode != 0 for process in processes)):
+
+            print("ERROR: A LIFE WORKER PROCESS FAILED")
+            return -1
+
+        return np.array(np.ndarray((rows, cols), dtype = np.uint8, buffer = memory[generations % 2].buf))
+
+    finally:
+
+        for m in memory:
+
+            m.close()
+            m.unlink()
+
+def _strip_worker(names, shape, r0, r1, generations, wrap, barrier):
+
+    """ Attaches to the shared boards and steps rows r0 through r1 of them for every generation """
+
+    memory = [shared_memory.SharedMemory(name = name) for name in names]
+
+    try:
+
+        _step_strip(memory, shape, r0, r1, generations, wrap, barrier)
+
+    finally:
+
+        for m in memory:
+
+            m.close()
+
+def _step_strip(memory, shape, r0, r1, generations, wrap, barrier):
+
+    """ Steps rows r0 through r1 of the double buffered boards in shared memory for every generation """
+
+    boards = [np.ndarray(shape, dtype = np.uint8, buffer = m.buf) for m in memory]
+
+    rows = shape[0]
+    cols = shape[1]
+
+    dead = np.zeros(cols, dtype = np.uint8)
+
+    for g in range(0, generations):
+
+        current_generation = boards[g % 2]
+        next_generation = boards[(g + 1) % 2]
+
+        #pick up the halo rows from the neighboring strips
+        if (wrap or r0 > 0):
+
+            above = current_generation[(r0 - 1) % rows]
+
+        else:
+
+            above = dead
+
+        if (wrap or r1 < rows):
+
+            below = current_generation[r1 % rows]
+
+        else:
+
+            below = dead
+
+        slab = np.vstack([above, current_generation[r0:r1], below])
+
+        if (wrap):
+
+            strip = _fates(np.pad(slab, ((0, 0), (1, 1)), mode = 'wrap'))[1:-1, 1:-1]
+
+        else:
+
+            strip = _fates(slab)[1:-1]
+
+            #leave the border dead
+            strip[:, 0] = 0
+            strip[:, -1] = 0
+
+            if (r0 == 0):
+
+                strip[0] = 0
+
+            if (r1 == rows):
+
+                strip[-1] = 0
+
+        next_generation[r0:r1] = strip
+
+        #wait for every strip of the next generation before it becomes the current one
+        barrier.wait()
+
+def _read_board(path):
+
+    """ Reads a binary image (0 or 255) or takes a binary (0 or 1) array as a uint8 board, None if it isn't binary """
+
+    #take the array as given
+    if (isinstance(path, np.ndarray)):
+
+        if (not np.all((path == 0) | (path == 1))):
+
+            return None
+
+        return np.ascontiguousarray(path, dtype = np.uint8)
+
+    #read in image as grayscale
+    src = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+    if (not np.all((src == 0) | (src == 255))):
+
+        return None
+
+    #normalize image to range [0:1] (assuming 8-bit image)
+    return (src == 255).astype(np.uint8)
+
+def _generations(board, generations, keep_every, packed):
+
+    """ Yields (generation number, board) for every keep_every-th generation of a uint8 board """
+
+    cols = np.shape(board)[1]
+
+    if (packed):
+
+        board = packBoard(board)
+
+    #yield generation zero (the original image)
+    yield 0, board
+
+    for g in range(1, generations + 1):
+
+        if (packed):
+
+            board = packedLifeStep(board, cols)
+
+        else:
+
+            board = lifeStep(board)
+
+        if (g % keep_every == 0):
+
+            yield g, board
+
+def lifeStep(board, wrap = False, rule = 'B3/S23'):
+
+    """ Advances a binary board by one generation of Conway's Game of Life (or another Life-like rule).
+
+    Args:
+        board (numpy.ndarray): 2D binary (0 or 1) board
+        wrap (bool): Wrap the board around into a torus. Otherwise the border of the board is left
+                     dead, as only the interior cells have eight neighbors.
+        rule (str): Life-like rulestring in B/S notation, e.g. 'B3/S23' (Conway), 'B36/S23' (HighLife), 'B2/S' (Seeds)
+
+    Returns:
+        next_generation (numpy.ndarray): The next generation of the board (uint8, range [0:1])
+
+    """
+
+    lut = _rule_lut(rule)
+
+    if (lut is None):
+
+        print("ERROR: PLEASE ENTER A VALID RULESTRING")
+        print("RULE REQUESTED:", rule)
+        return -1
+
+    board = np.ascontiguousarray(board, dtype = np.uint8)
+
+    if (wrap):
+
+        #surround the board with the opposite edges so every cell has eight neighbors
+        return np.ascontiguousarray(_fates(np.pad(board, 1, mode = 'wrap'), lut)[1:-1, 1:-1])
+
+    next_generation = _fates(board, lut)
+
+    #leave the border dead
+    next_generation[0, :] = 0
+    next_generation[-1, :] = 0
+    next_generation[:, 0] = 0
+    next_generation[:, -1] = 0
+
+    return next_generation
+
+def _fates(board, lut = None):
+
+    """ Looks up the next value of every cell of a contiguous uint8 board (cells outside the board count as dead) """
+
+    #sum every 3x3 neighborhood at once (this includes the cell itself)
+    neighborhood = cv2.boxFilter(board, -1, (3, 3), normalize = False, borderType = cv2.BORDER_CONSTANT)
+
+    #combine the cell and its neighborhood into one index, then look up every fate at once
+    index = board * np.uint8(10)
+    index += neighborhood
+
+    if (lut is None):
+
+        lut = _CONWAY_LUT
+
+    return cv2.LUT(index, lut)
+
+def _lookup_table(rule):
+
+    """ Flattens a [current value, living neighbors] fate table into a 256 entry cv2.LUT table,
+        indexed by (10 * current value) + (living cells in the 3x3 neighborhood).
+
+    """
+
+    table = np.zeros(256, dtype = np.uint8)
+
+    for n in range(0, 9):
+
+        table[n] = rule[0, n]
+        table[10 + n + 1] = rule[1, n]
+
+    return table
+
+_CONWAY_LUT = _lookup_table(CONWAY)
+
+def packBoard(board):
+
+    """ Packs a binary board into 64 cells per machine word.
+
+    Args:
+        board (numpy.ndarray): 2D binary (0 or 1) board
+
+    Returns:
+        packed (numpy.ndarray): (rows, ceil(cols / 64)) uint64 board. Bit i of word j holds column (64 * j) + i.
+
+    """
+
+    board = np.asarray(board, dtype = np.uint8)
+
+    #get the rows, cols in the board
+    rows = np.shape(board)[0]
+    cols = np.shape(board)[1]
+
+    words = -(-cols // 64)
+
+    #pad the columns out to whole words
+    padded = np.zeros((rows, words * 64), dtype = np.uint8)
+    padded[:, :cols] = board
+
+    packed = np.packbits(padded, axis = 1, bitorder = 'little')
+
+    return packed.view('<u8').astype(np.uint64)
+
+def unpackBoard(packed, cols):
+
+    """ Unpacks a board made by packBoard back into a binary board.
+
+    Args:
+        packed (numpy.ndarray): (rows, words) uint64 board
+        cols (int): The number of columns in the unpacked board
+
+    Returns:
+        board (numpy.ndarray): 2D binary board (uint8, range [0:1])
+
+    """
+
+    packed = np.ascontiguousarray(packed, dtype = '<u8')
+
+    return np.unpackbits(packed.view(np.uint8), axis = 1, bitorder = 'little')[:, :cols]
+
+def packedLifeStep(packed, cols, block_rows = 256):
+
+    """ Advances a packed board by one generation of Conway's Game of Life.
+        Every word updates 64 cells at once through a bitwise adder of the eight neighbor bitplanes.
+        The board is worked through in blocks of rows so the temporaries stay in cache.
+        Like lifeStep, the border of the board is left dead.
+
+    Args:
+        packed (numpy.ndarray): (rows, words) uint64 board from packBoard
+        cols (int): The number of columns in the unpacked board
+        block_rows (int): The number of rows to update at a time
+
+    Returns:
+        next_generation (numpy.ndarray): The next generation of the packed board
+
+    """
+
+    rows = np.shape(packed)[0]
+    words = np.shape(packed)[1]
+
+    #mask that clears the border columns and the padding bits
+    interior = np.ones((1, cols), dtype = np.uint8)
+    interior[0, 0] = 0
+    interior[0, cols-1] = 0
+    interior = packBoard(interior)[0]
+
+    #surround the board with a dead row above and below
+    padded = np.zeros((rows + 2, words), dtype = np.uint64)
+    padded[1:rows+1] = packed
+
+    next_generation = np.empty((rows, words), dtype = np.uint64)
+
+    for r in range(0, rows, block_rows):
+
+        #rows r-1 through r+h of the board, i.e. the block and its halo
+        h = min(block_rows, rows - r)
+        slab = padded[r:r+h+2]
+
+        next_generation[r:r+h] = _packed_slab_step(slab) & interior
+
+    #leave the border dead
+    if (rows > 0):
+
+        next_generation[0] = 0
+        next_generation[rows-1] = 0
+
+    return next_generation
+
+def _packed_slab_step(slab):
+
+    """ Steps the inner rows of a packed slab whose first and last rows are the halo """
+
+    one = np.uint64(1)
+    last = np.uint64(63)
+
+    #shift in the bit from the neighboring word so west/east hold columns c-1/c+1 at bit c
+    west = slab << one
+    west[:, 1:] |= slab[:, :-1] >> last
+    east = slab >> one
+    east[:, :-1] |= slab[:, 1:] << last
+
+    center = slab[1:-1]
+
+    planes = [west[:-2], slab[:-2], east[:-2], west[1:-1], east[1:-1], west[2:], slab[2:], east[2:]]
+
+    #count the living neighbors bitwise: s0 and s1 are the low bits, s2 flags four or more
+    s0 = np.zeros(np.shape(center), dtype = np.uint64)
+    s1 = np.zeros(np.shape(center), dtype = np.uint64)
+    s2 = np.zeros(np.shape(center), dtype = np.uint64)
+
+    for plane in planes:
+
+        carry = s0 & plane
+        s0 ^= plane
+        carry2 = s1 & carry
+        s1 ^= carry
+        s2 |= carry2
+
+    #born with exactly three neighbors, survive with two or three
+    return s1 & ~s2 & (s0 | center)
+
+def parseRule(rule):
+
+    """ Parses a Life-like rulestring in B/S notation into a fate table.
+
+    Args:
+        rule (str): Rulestring such as 'B3/S23' (Conway), 'B36/S23' (HighLife) or 'B2/S' (Seeds).
+                    The birth and survival parts may come in either order and case does not matter.
+
+    Returns:
+        table (numpy.ndarray): (2, 9) uint8 fate table indexed [current value, living neighbors], None if the rule is invalid
+
+    """
+
+    match = re.fullmatch(r'\s*B([0-8]*)\s*/\s*S([0-8]*)\s*', rule, re.IGNORECASE)
+
+    #also accept the survival part first
+    if (match is not None):
+
+        birth, survival = match.group(1), match.group(2)
+
+    else:
+
+        match = re.fullmatch(r'\s*S([0-8]*)\s*/\s*B([0-8]*)\s*', rule, re.IGNORECASE)
+
+        if (match is None):
+
+            return None
+
+        survival, birth = match.group(1), match.group(2)
+
+    table = np.zeros((2, 9), dtype = np.uint8)
+
+    for n in birth:
+
+        table[0, int(n)] = 1
+
+    for n in survival:
+
+        table[1, int(n)] = 1
+
+    return table
+
+@lru_cache(maxsize = None)
+def _rule_lut(rule):
+
+    """ cv2.LUT table for a rulestring, None if the rule is invalid """
+
+    table = parseRule(rule)
+
+    if (table is None):
+
+        return None
+
+    return _lookup_table(table)
+
+def lifeEnsemble(boards, rule, generations, wrap = False):
+
+    """ Advances a whole stack of boards at once under a Life-like rule, tracking their populations.
+
+    Details: The stack is laid out as one tall image so a single neighborhood sum and a single
+             rule lookup step every board per generation. Only the current generation is kept.
+
+    Args:
+        boards (numpy.ndarray): (boards, rows, cols) stack of binary (0 or 1) boards
+        rule (str): Life-like rulestring in B/S notation, e.g. 'B3/S23' or 'B36/S23'
+        generations (int): How many generations you want to run, not including the zero generation.
+        wrap (bool): Wrap every board around into a torus. Otherwise the borders are left dead.
+
+    Returns:
+        result (dict): 'populations' -> (boards, generations + 1) living cells of every board in every generation
+                       'boards' -> the stack at the final generation (uint8, range [0:1])
+
+    """
+
+    lut = _rule_lut(rule)
+
+    if (lut is None):
+
+        print("ERROR: PLEASE ENTER A VALID RULESTRING")
+        print("RULE REQUESTED:", rule)
+        return -1
+
+    boards = np.asarray(boards)
+
+    if (boards.ndim != 3):
+
+        print("ERROR: PLEASE PROVIDE A (boards, rows, cols) STACK")
+        return -1
+
+    #catch nonbinary issue once, up front
+    if (not np.all((boards == 0) | (boards == 1))):
+
+        print("ERROR: PLEASE PROVIDE BINARY BOARDS")
+        return -1
+
+    number_of_boards = np.shape(boards)[0]
+    rows = np.shape(boards)[1]
+    cols = np.shape(boards)[2]
+
+    current_generation = np.ascontiguousarray(boards, dtype = np.uint8)
+
+    populations = np.zeros((number_of_boards, generations + 1), dtype = np.int64)
+    populations[:, 0] = np.sum(current_generation, axis = (1, 2))
+
+    for g in range(1, generations + 1):
+
+        if (wrap):
+
+            #wrap every board on its own, then stack them so the neighborhoods never mix
+            padded = np.pad(current_generation, ((0, 0), (1, 1), (1, 1)), mode = 'wrap')
+            tall = padded.reshape(number_of_boards * (rows + 2), cols + 2)
+            stepped = _fates(tall, lut).reshape(number_of_boards, rows + 2, cols + 2)
+            current_generation = np.ascontiguousarray(stepped[:, 1:-1, 1:-1])
+
+        else:
+
+            #border cells are killed, so neighborhoods that straddle two boards never matter
+            tall = current_generation.reshape(number_of_boards * rows, cols)
+            current_generation = _fates(tall, lut).reshape(number_of_boards, rows, cols)
+
+            #leave the borders dead
+            current_generation[:, 0, :] = 0
+            current_generation[:, -1, :] = 0
+            current_generation[:, :, 0] = 0
+            current_generation[:, :, -1] = 0
+
+        populations[:, g] = np.sum(current_generation, axis = (1, 2))
+
+    result = {}
+    result['populations'] = populations
+    result['boards'] = current_generation
+
+    return result
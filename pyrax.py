@@ -1,58 +1,611 @@
 import os
+import sys
+import csv
+import json
+import argparse
+import threading
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-os.system('cls' if os.name == 'nt' else 'clear')
+def opticalSystem(curvature, power, thickness, index):
 
+    """ Collects a paraxial optical system into one array per attribute
 
-print("\n")
-print("* * * * * * * * * * * * * * *")
-print("Pyrax: A Terminal-Based Paraxial Raytracing Application Written in Python")
-print("Author: Gregory M. Nero")
-print("Contact: gnero@email.arizona.edu")
-print("Version 0.1")
-print("* * * * * * * * * * * * * * *")
-print("\n")
+    Details: Surfaces are numbered 0 to N-1. Space 0 is object space, in front of surface 0, and
+             space k+1 is the space following surface k, so space N is image space. The thickness
+             of image space is the distance from the last surface to the image plane.
 
-print("Enter System Specifications")
-number_of_surfaces = int(input("Number of Surfaces: "))
-number_of_spaces = number_of_surfaces + 1
-number_of_rays = int(input("Number of Rays: "))
-number_of_surface_attributes = 2 + number_of_rays
-number_of_space_attributes = 2 + number_of_rays
-surfaces = {surf: np.zeros(number_of_surface_attributes) for surf in range(number_of_surfaces)}
-spaces = {spac: np.zeros(number_of_space_attributes) for spac in range(number_of_spaces)}
+    Args:
+        curvature (list): N radii of curvature of the surfaces [mm]
+        power (list): N powers of the surfaces [mm^-1]
+        thickness (list): N+1 thicknesses of the spaces [mm]
+        index (list): N+1 indices of refraction of the spaces
 
-print("\n")
+    Returns:
+        system (dict): 'curvature' -> (N,) radii of curvature [mm]
+                       'power' -> (N,) surface powers [mm^-1]
+                       'thickness' -> (N+1,) space thicknesses [mm]
+                       'index' -> (N+1,) space indices of refraction
 
-print("Enter Ray Properties")
-for ray in range(0, number_of_rays):
-    
-    print("* Ray Number:", ray)
+    """
 
-    ray_height_in_image_plane = float(input("Ray Height in Image Plane [mm]: "))
+    system = {}
+    system['curvature'] = np.asarray(curvature, dtype = np.float64).ravel()
+    system['power'] = np.asarray(power, dtype = np.float64).ravel()
+    system['thickness'] = np.asarray(thickness, dtype = np.float64).ravel()
+    system['index'] = np.asarray(index, dtype = np.float64).ravel()
 
-    surfaces[0][2 + ray] = ray_height_in_image_plane
+    number_of_surfaces = len(system['power'])
 
-print("\n")
+    #argcheck to make sure every attribute is given for every surface and space
+    if (number_of_surfaces < 1 or len(system['curvature']) != number_of_surfaces):
 
-print("Enter Surface Properties")
-for surface in range(0, number_of_surfaces):
+        print("ERROR: PLEASE GIVE A CURVATURE AND POWER FOR EVERY SURFACE")
+        return -1
 
-    print("* Surface Number:", surface)
-    curvature = float(input("Radius of Curvature [mm]: "))
-    power = float(input("Power [mm^-1]: "))
+    if (len(system['thickness']) != number_of_surfaces + 1 or len(system['index']) != number_of_surfaces + 1):
 
-    surfaces[surface][0] = curvature
-    surfaces[surface][1] = power
+        print("ERROR: PLEASE GIVE A THICKNESS AND INDEX FOR EVERY SPACE (NUMBER OF SURFACES + 1)")
+        return -1
 
-print("\n")
+    if (np.any(system['index'] <= 0)):
 
-print("Enter Space Properties")
-for space in range(0, number_of_spaces):
+        print("ERROR: PLEASE ENTER VALID INDICES OF REFRACTION")
+        return -1
 
-    print("* Space Number:", space)
-    thickness = float(input("Thickness [mm]: "))
-    index_of_refraction = float(input("Index of Refraction: "))
+    return system
 
-    spaces[space][0] = thickness
-    spaces[space][1] = index_of_refraction
+def paraxialTrace(system, heights, angles = 0.0):
+
+    """ Traces a batch of paraxial rays through an optical system with the y-nu equations
+
+    Details: Every surface is a single vectorized step over all of the rays at once:
+             refraction nu' = nu - y * power, then transfer y' = y + thickness * nu' / index.
+             The loop only runs over the surfaces, so the rays can be any number or shape.
+
+    Args:
+        system (dict): Optical system from opticalSystem
+        heights (numpy.ndarray): Ray heights at surface 0 [mm], any shape
+        angles (numpy.ndarray): Ray angles in object space [rad], broadcast against heights
+
+    Returns:
+        rays (dict): 'heights' -> (N+1, ...) ray heights at every surface, then at the image plane [mm]
+                     'angles' -> (N+1, ...) ray angles in every space, object space first [rad]
+
+    """
+
+    power = system['power']
+    thickness = system['thickness']
+    index = system['index']
+
+    heights, angles = np.broadcast_arrays(np.asarray(heights, dtype = np.float64), np.asarray(angles, dtype = np.float64))
+
+    number_of_surfaces = len(power)
+
+    #instantiate storage for the rays at every surface / in every space
+    y = np.empty((number_of_surfaces + 1,) + heights.shape)
+    u = np.empty((number_of_surfaces + 1,) + heights.shape)
+
+    y[0] = heights
+    u[0] = angles
+
+    #reduced angle (n * u), which is what refraction changes
+    nu = angles * index[0]
+
+    for surface in range(0, number_of_surfaces):
+
+        #refract at this surface
+        nu -= y[surface] * power[surface]
+
+        u[surface + 1] = nu / index[surface + 1]
+
+        #transfer to the next surface (or the image plane)
+        y[surface + 1] = y[surface] + (u[surface + 1] * thickness[surface + 1])
+
+    rays = {}
+    rays['heights'] = y
+    rays['angles'] = u
+
+    return rays
+
+def systemMatrix(system):
+
+    """ Gets the 2x2 y-nu transfer matrix of an optical system, from surface 0 to the image plane
+
+    Details: [y', nu'] = matrix @ [y, nu], with y at surface 0 and nu in object space.
+             The matrix is cached by the powers, thicknesses and indices of the system, so
+             tracing ray batch after ray batch through the same system builds it only once.
+
+    Args:
+        system (dict): Optical system from opticalSystem
+
+    Returns:
+        matrix (numpy.ndarray): (2, 2) system matrix [[A, B], [C, D]]
+
+    """
+
+    key = system['power'].tobytes() + b'|' + system['thickness'].tobytes() + b'|' + system['index'].tobytes()
+
+    with _matrix_cache_lock:
+
+        if (key in _matrix_cache):
+
+            _matrix_cache.move_to_end(key)
+            return _matrix_cache[key]
+
+    matrix = _sweep_matrices(system['power'], system['thickness'], system['index'])['image']
+    matrix.setflags(write = False)
+
+    with _matrix_cache_lock:
+
+        _matrix_cache[key] = matrix
+
+        while (len(_matrix_cache) > _matrix_cache_limit[0]):
+
+            _matrix_cache.popitem(last = False)
+
+    return matrix
+
+def paraxialImage(system, heights, angles = 0.0):
+
+    """ Traces a batch of paraxial rays straight to the image plane through the cached system matrix
+
+    Args:
+        system (dict): Optical system from opticalSystem
+        heights (numpy.ndarray): Ray heights at surface 0 [mm], any shape
+        angles (numpy.ndarray): Ray angles in object space [rad], broadcast against heights
+
+    Returns:
+        rays (dict): 'heights' -> ray heights at the image plane [mm]
+                     'angles' -> ray angles in image space [rad]
+
+    """
+
+    matrix = systemMatrix(system)
+
+    heights = np.asarray(heights, dtype = np.float64)
+    nu = np.asarray(angles, dtype = np.float64) * system['index'][0]
+
+    rays = {}
+    rays['heights'] = (matrix[0, 0] * heights) + (matrix[0, 1] * nu)
+    rays['angles'] = ((matrix[1, 0] * heights) + (matrix[1, 1] * nu)) / system['index'][-1]
+
+    return rays
+
+def paraxialSweep(power, thickness, index, marginal_height = 1.0):
+
+    """ Evaluates a whole stack of variant systems at once
+
+    Details: Every variant is reduced to its 2x2 y-nu matrices, and the stack is multiplied
+             together surface by surface as batched matrix products, so there is no python loop
+             over the variants. The marginal ray starts parallel to the axis (object at infinity).
+
+    Args:
+        power (numpy.ndarray): (..., N) surface powers of every variant [mm^-1]
+        thickness (numpy.ndarray): (..., N+1) space thicknesses of every variant [mm]
+        index (numpy.ndarray): (..., N+1) space indices of refraction of every variant
+        marginal_height (float): Height of the marginal ray at surface 0 [mm]
+
+    Returns:
+        sweep (dict): 'efl' -> (...) effective focal lengths [mm]
+                      'bfl' -> (...) back focal lengths, last surface to rear focal point [mm]
+                      'marginal_heights' -> (..., N+1) marginal ray heights at every surface, then at the image plane [mm]
+                      'matrix' -> (..., 2, 2) y-nu matrices from surface 0 to the last surface
+
+    The leading dimensions of power, thickness and index are broadcast against each other,
+    so e.g. one (N,) set of powers can be swept against a (V, N+1) stack of thicknesses.
+
+    """
+
+    power = np.asarray(power, dtype = np.float64)
+    thickness = np.asarray(thickness, dtype = np.float64)
+    index = np.asarray(index, dtype = np.float64)
+
+    number_of_surfaces = np.shape(power)[-1]
+
+    #argcheck to make sure every variant has every surface and space
+    if (np.shape(thickness)[-1] != number_of_surfaces + 1 or np.shape(index)[-1] != number_of_surfaces + 1):
+
+        print("ERROR: PLEASE GIVE A THICKNESS AND INDEX FOR EVERY SPACE (NUMBER OF SURFACES + 1)")
+        return -1
+
+    matrices = _sweep_matrices(power, thickness, index)
+    matrix = matrices['system']
+
+    A = matrix[..., 0, 0]
+    C = matrix[..., 1, 0]
+
+    #a zero power system has no focal points, so its focal lengths are infinite
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        efl = np.where(C == 0, np.inf, -1 / C)
+        bfl = np.where(C == 0, np.inf, -A * index[..., -1] / C)
+
+    sweep = {}
+    sweep['efl'] = efl
+    sweep['bfl'] = bfl
+    sweep['marginal_heights'] = matrices['heights'] * marginal_height
+    sweep['matrix'] = matrix
+
+    return sweep
+
+def readPrescription(path):
+
+    """ Reads a lens prescription from a JSON or CSV file
+
+    Details: A JSON file holds an object with the lists "curvature", "power", "thickness" and
+             "index", and optionally "heights" and "angles" for its rays.
+             A CSV file has a header row and one row per space: row k holds the "thickness" and
+             "index" of space k and the "curvature" and "power" of surface k, so the last row
+             (image space) leaves curvature and power empty. Optional "height" and "angle"
+             columns list the rays, one per row, with empty cells past the last ray.
+
+    Args:
+        path (str): Path to the .json or .csv prescription
+
+    Returns:
+        prescription (dict): 'system' -> optical system from opticalSystem
+                             'heights' -> ray heights at surface 0 [mm], None if the file gives none
+                             'angles' -> ray angles in object space [rad], None if the file gives none
+
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if (extension == '.json'):
+
+        with open(path) as f:
+
+            columns = json.load(f)
+
+        if (not isinstance(columns, dict)):
+
+            print("ERROR: THE PRESCRIPTION SHOULD BE A JSON OBJECT OF LISTS")
+            print("PRESCRIPTION GIVEN:", path)
+            return -1
+
+    elif (extension == '.csv'):
+
+        with open(path, newline = '') as f:
+
+            rows = list(csv.DictReader(f))
+
+        #gather every column, skipping its empty cells
+        columns = {}
+
+        for name in ['curvature', 'power', 'thickness', 'index', 'height', 'angle']:
+
+            cells = [row.get(name) for row in rows]
+            columns[name + 's' if name in ['height', 'angle'] else name] = [float(cell) for cell in cells if cell is not None and cell.strip() != '']
+
+    else:
+
+        print("ERROR: PLEASE GIVE A .json OR .csv PRESCRIPTION")
+        print("PRESCRIPTION GIVEN:", path)
+        return -1
+
+    for name in ['curvature', 'power', 'thickness', 'index']:
+
+        if (name not in columns):
+
+            print("ERROR: THE PRESCRIPTION HAS NO", name, "LIST")
+            print("PRESCRIPTION GIVEN:", path)
+            return -1
+
+    system = opticalSystem(columns['curvature'], columns['power'], columns['thickness'], columns['index'])
+
+    if (isinstance(system, int)):
+
+        return -1
+
+    prescription = {}
+    prescription['system'] = system
+    prescription['heights'] = np.asarray(columns['heights'], dtype = np.float64) if columns.get('heights') else None
+    prescription['angles'] = np.asarray(columns['angles'], dtype = np.float64) if columns.get('angles') else None
+
+    return prescription
+
+def pyraxBatch(paths, dst_path, heights = None, angles = None, workers = None):
+
+    """ Traces a whole catalog of prescription files in a process pool and writes every trace to one columnar file
+
+    Details: The output is one long table with a row per (prescription, ray, plane), where plane 0 to N-1
+             are the surfaces and plane N is the image plane of that file. The columns are
+             prescription, ray, plane, height [mm], angle [rad] (in the space after the plane), efl [mm] and bfl [mm].
+             A .npz output keeps every column as its own array, a .csv output writes them as a table.
+
+    Args:
+        paths (list): Paths to the .json / .csv prescriptions
+        dst_path (str): Path of the .npz or .csv output
+        heights (list): Ray heights at surface 0 [mm] for files that give no rays. Defaults to a single ray of height 1.
+        angles (list): Ray angles in object space [rad] for files that give no rays. Defaults to 0.
+        workers (int): Number of processes. Defaults to the number of cpus.
+
+    Returns:
+        traced (int): Number of files traced. Files that cannot be read are reported and skipped.
+
+    """
+
+    extension = os.path.splitext(dst_path)[1].lower()
+
+    if (extension != '.npz' and extension != '.csv'):
+
+        print("ERROR: PLEASE GIVE A .npz OR .csv OUTPUT")
+        print("OUTPUT GIVEN:", dst_path)
+        return -1
+
+    if (workers is None):
+
+        workers = os.cpu_count() or 1
+
+    paths = list(paths)
+
+    #hand the files out in chunks so small prescriptions do not pay for a round trip each
+    chunksize = max(1, len(paths) // (workers * 4))
+    jobs = [(path, heights, angles) for path in paths]
+
+    tables = []
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+
+        for table in pool.map(_trace_file, jobs, chunksize = chunksize):
+
+            if (table is not None):
+
+                tables.append(table)
+
+    #put the columns of every file end to end
+    columns = {}
+
+    for name in ['prescription', 'ray', 'plane', 'height', 'angle', 'efl', 'bfl']:
+
+        columns[name] = np.concatenate([table[name] for table in tables]) if len(tables) > 0 else np.zeros(0)
+
+    if (extension == '.npz'):
+
+        np.savez(dst_path, **columns)
+
+    else:
+
+        with open(dst_path, 'w', newline = '') as f:
+
+            writer = csv.writer(f)
+            writer.writerow(list(columns.keys()))
+            writer.writerows(zip(*[column.tolist() for column in columns.values()]))
+
+    return len(tables)
+
+def main(argv = None):
+
+    """ Command line entry point. Traces the prescription files given, or runs the terminal application when there are none.
+
+    Args:
+        argv (list): Command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        status (int): 0 on success, 1 otherwise
+
+    """
+
+    parser = argparse.ArgumentParser(prog = 'pyrax', description = 'Paraxial raytracing of lens prescriptions.')
+    parser.add_argument('prescriptions', nargs = '*', help = '.json / .csv prescription files, the terminal application runs when none are given')
+    parser.add_argument('-o', '--output', default = 'pyrax.npz', help = '.npz or .csv file to write every trace to')
+    parser.add_argument('--heights', type = float, nargs = '+', help = 'ray heights at surface 0 [mm] for files that give no rays')
+    parser.add_argument('--angles', type = float, nargs = '+', help = 'ray angles in object space [rad] for files that give no rays')
+    parser.add_argument('--workers', type = int, help = 'number of processes')
+    args = parser.parse_args(argv)
+
+    if (len(args.prescriptions) == 0):
+
+        return 0 if pyrax() != -1 else 1
+
+    traced = pyraxBatch(args.prescriptions, args.output, args.heights, args.angles, args.workers)
+
+    if (traced == -1):
+
+        return 1
+
+    print("TRACED", traced, "OF", len(args.prescriptions), "PRESCRIPTIONS INTO", args.output)
+
+    return 0 if traced == len(args.prescriptions) else 1
+
+def pyrax():
+
+    """ Runs pyrax as a terminal application, prompting for the system and rays and printing the trace """
+
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+    print("\n")
+    print("* * * * * * * * * * * * * * *")
+    print("Pyrax: A Terminal-Based Paraxial Raytracing Application Written in Python")
+    print("Author: Gregory M. Nero")
+    print("Contact: gnero@email.arizona.edu")
+    print("Version 0.1")
+    print("* * * * * * * * * * * * * * *")
+    print("\n")
+
+    print("Enter System Specifications")
+    number_of_surfaces = int(input("Number of Surfaces: "))
+    number_of_spaces = number_of_surfaces + 1
+    number_of_rays = int(input("Number of Rays: "))
+
+    heights = np.zeros(number_of_rays)
+    angles = np.zeros(number_of_rays)
+    curvatures = np.zeros(number_of_surfaces)
+    powers = np.zeros(number_of_surfaces)
+    thicknesses = np.zeros(number_of_spaces)
+    indices = np.zeros(number_of_spaces)
+
+    print("\n")
+
+    print("Enter Ray Properties")
+    for ray in range(0, number_of_rays):
+
+        print("* Ray Number:", ray)
+
+        heights[ray] = float(input("Ray Height at Surface 0 [mm]: "))
+        angles[ray] = float(input("Ray Angle in Object Space [rad]: "))
+
+    print("\n")
+
+    print("Enter Surface Properties")
+    for surface in range(0, number_of_surfaces):
+
+        print("* Surface Number:", surface)
+        curvatures[surface] = float(input("Radius of Curvature [mm]: "))
+        powers[surface] = float(input("Power [mm^-1]: "))
+
+    print("\n")
+
+    print("Enter Space Properties")
+    for space in range(0, number_of_spaces):
+
+        print("* Space Number:", space)
+        thicknesses[space] = float(input("Thickness [mm]: "))
+        indices[space] = float(input("Index of Refraction: "))
+
+    system = opticalSystem(curvatures, powers, thicknesses, indices)
+
+    if (isinstance(system, int)):
+
+        return -1
+
+    rays = paraxialTrace(system, heights, angles)
+
+    print("\n")
+
+    print("Trace")
+    for ray in range(0, number_of_rays):
+
+        print("* Ray Number:", ray)
+
+        for surface in range(0, number_of_surfaces):
+
+            print("Surface", surface, "| Height [mm]:", rays['heights'][surface][ray], "| Angle After [rad]:", rays['angles'][surface + 1][ray])
+
+        print("Image Plane | Height [mm]:", rays['heights'][number_of_surfaces][ray])
+
+def _sweep_matrices(power, thickness, index):
+
+    """ Multiplies out the y-nu matrices of a stack of systems as batched 2x2 products
+
+    Returns:
+        matrices (dict): 'system' -> (..., 2, 2) from surface 0 to the last surface
+                         'image' -> (..., 2, 2) from surface 0 to the image plane
+                         'heights' -> (..., N+1) A entries at every surface and the image plane,
+                                      i.e. the heights of a unit ray parallel to the axis
+
+    """
+
+    number_of_surfaces = np.shape(power)[-1]
+    batch = np.broadcast_shapes(np.shape(power)[:-1], np.shape(thickness)[:-1], np.shape(index)[:-1])
+
+    #reduced thickness of every space
+    reduced = np.broadcast_to(thickness / index, batch + (number_of_surfaces + 1,))
+    power = np.broadcast_to(power, batch + (number_of_surfaces,))
+
+    refraction = np.zeros(batch + (2, 2))
+    refraction[..., 0, 0] = 1
+    refraction[..., 1, 1] = 1
+
+    transfer = np.zeros(batch + (2, 2))
+    transfer[..., 0, 0] = 1
+    transfer[..., 1, 1] = 1
+
+    product = np.zeros(batch + (2, 2))
+    product[..., 0, 0] = 1
+    product[..., 1, 1] = 1
+
+    heights = np.empty(batch + (number_of_surfaces + 1,))
+
+    for surface in range(0, number_of_surfaces):
+
+        heights[..., surface] = product[..., 0, 0]
+
+        refraction[..., 1, 0] = -power[..., surface]
+        product = np.matmul(refraction, product)
+
+        if (surface == number_of_surfaces - 1):
+
+            system = product
+
+        transfer[..., 0, 1] = reduced[..., surface + 1]
+        product = np.matmul(transfer, product)
+
+    heights[..., number_of_surfaces] = product[..., 0, 0]
+
+    matrices = {}
+    matrices['system'] = system
+    matrices['image'] = product
+    matrices['heights'] = heights
+
+    return matrices
+
+def _trace_file(job):
+
+    """ Reads and traces one prescription for pyraxBatch, returning its columns (None if it cannot be read) """
+
+    path, heights, angles = job
+
+    #a file that cannot be opened or parsed is skipped like any other bad prescription
+    try:
+
+        prescription = readPrescription(path)
+
+    except (OSError, ValueError, TypeError) as error:
+
+        print("ERROR: COULD NOT READ THE PRESCRIPTION:", error)
+        prescription = -1
+
+    if (isinstance(prescription, int)):
+
+        print("WARNING: SKIPPING", path)
+        return None
+
+    system = prescription['system']
+
+    #rays in the file come first, then the ones given for the batch, then a single unit ray
+    if (prescription['heights'] is not None or prescription['angles'] is not None):
+
+        heights = prescription['heights'] if prescription['heights'] is not None else 1.0
+        angles = prescription['angles'] if prescription['angles'] is not None else 0.0
+
+    heights = np.asarray(1.0 if heights is None else heights, dtype = np.float64)
+    angles = np.asarray(0.0 if angles is None else angles, dtype = np.float64)
+
+    try:
+
+        heights, angles = np.broadcast_arrays(np.atleast_1d(heights), np.atleast_1d(angles))
+
+    except ValueError:
+
+        print("ERROR: PLEASE GIVE AS MANY RAY ANGLES AS RAY HEIGHTS")
+        print("WARNING: SKIPPING", path)
+        return None
+
+    rays = paraxialTrace(system, heights, angles)
+    sweep = paraxialSweep(system['power'], system['thickness'], system['index'])
+
+    #one row per (ray, plane), so the angle of a plane is the one in the space after it
+    planes, number_of_rays = np.shape(rays['heights'])
+
+    table = {}
+    table['prescription'] = np.full(planes * number_of_rays, path)
+    table['ray'] = np.tile(np.arange(number_of_rays), planes)
+    table['plane'] = np.repeat(np.arange(planes), number_of_rays)
+    table['height'] = rays['heights'].ravel()
+    table['angle'] = np.concatenate([rays['angles'][1:], rays['angles'][-1:]]).ravel()
+    table['efl'] = np.full(planes * number_of_rays, float(sweep['efl']))
+    table['bfl'] = np.full(planes * number_of_rays, float(sweep['bfl']))
+
+    return table
+
+#system matrices shared by every trace, most recently used last
+_matrix_cache = OrderedDict()
+_matrix_cache_limit = [4096]
+_matrix_cache_lock = threading.Lock()
+
+if __name__ == '__main__':
+
+    sys.exit(main())
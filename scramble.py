@@ -1,6 +1,13 @@
+import os
+import json
+import math
+import threading
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 
 def scramble(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b):
 
@@ -14,7 +21,8 @@ def scramble(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b):
              rearranging the pixel code values. After some number of scrambles T the image 
              will exactly re-arrange itself. T is the period of this automorphism for image
              of size NxN and free paramater k. Finding T is a nontrivial task because of its
-             chaotic nature. It can be experimentally determined through image processing.
+             chaotic nature. It can be experimentally determined through image processing,
+             or computed directly with scramblePeriod(N, k).
              I wrote a report on this if you are interested.
 
     Example Usage (Visual Cryptography): You have a "secret image" containing a message for 
@@ -22,10 +30,13 @@ def scramble(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b):
             that S is less than T. You must know T for this to work. Then, you send this
             scrambled image to the other party. They can retrieve the secret image by
             scrambling the already scrambled image (T-S) times with the same k value. In 
-            effect, they are just "completing the orbit" of the period.
+            effect, they are just "completing the orbit" of the period. Or, without knowing
+            T at all, they can call unscramble() with the same k and S.
 
     Comment on Color: Users now have the option to independently scramble each R,G,B color
                       channel! Each channel has its own k and S value. Have fun!
+                      The scrambled image keeps cv2's BGR channel order, so it can be written
+                      with cv2.imwrite and scrambled again to complete the orbit.
 
     Args:
         path (str): Path to the image
@@ -42,155 +53,667 @@ def scramble(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b):
         S_b (int): The number of times you want to scramble the blue channel with k_b
 
     Returns:
-        dst (numpy.ndarray): The scrambled input image
+        dst (numpy.ndarray): The scrambled input image (uint8)
 
     """
 
+    src, keys = _read_keyed_image(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b)
+
+    #ensure input image is square
+    if (np.shape(src)[0] != np.shape(src)[1]):
+
+        print("ERROR: Please provide a square image to scramble.")
+        return -1
+
+    return _scramble_image(src, keys)
+
+def unscramble(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b):
+
+    """ Recovers a secret image scrambled by scramble(), using the same key parameters.
+
+    Details: Instead of completing the orbit with (T-S) more scrambles, the inverse automorphism
+             [[k + 1, -1], [-k, 1]] is raised to the power S mod N and applied once, so the cost
+             does not depend on T or S.
+
+    Args:
+        path (str): Path to the scrambled image
+        k (int): Free parameter the image was scrambled with
+        S (int): The number of scrambles the image went through
+        c (boolean): Choice between color or grayscale input image.
+                     True -> color image input
+                     False -> grayscale image input
+        k_r (int): Free paramater the red channel was scrambled with
+        k_g (int): Free parameter the green channel was scrambled with
+        k_b (int): Free parameter the blue channel was scrambled with
+        S_r (int): The number of scrambles the red channel went through
+        S_g (int): The number of scrambles the green channel went through
+        S_b (int): The number of scrambles the blue channel went through
+
+    Returns:
+        dst (numpy.ndarray): The unscrambled image (uint8)
+
+    """
+
+    src, keys = _read_keyed_image(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b)
+
+    #ensure input image is square
+    if (np.shape(src)[0] != np.shape(src)[1]):
+
+        print("ERROR: Please provide a square image to unscramble.")
+        return -1
+
+    #undoing S scrambles is scrambling -S times
+    return _scramble_image(src, [(key, -scrambles) for key, scrambles in keys])
+
+def _read_keyed_image(path, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b):
+
+    """ Reads the image for scramble/unscramble (skipped if path is None) along with one (k, S) key per channel """
+
     #for grayscale images
     if (c == False):
 
-        #establish parameters for this toral automorphic family
-        a1 = 1
-        a2 = 1
-        a3 = k
-        a4 = k + 1
-
         #read in image as grayscale
-        src = cv2.imread(path, cv2.IMREAD_GRAYSCALE) 
+        src = cv2.imread(path, cv2.IMREAD_GRAYSCALE) if path is not None else None
 
-        #get the rows, cols in the image
-        rows = np.shape(src)[0]
-        cols = np.shape(src)[1]
+        keys = [(k, S)]
 
-        #ensure input image is square
-        if (rows != cols):
+    #for color images
+    else:
 
-            print("ERROR: Please provide a square image to scramble.")
-            return -1
+        #read in image as color
+        src = cv2.imread(path, cv2.IMREAD_COLOR) if path is not None else None
 
-        #instantiate blank array for the scrambled image
-        scrambled = np.zeros((rows, cols), dtype = np.uint8)
+        #each channel has its own key (in cv2's BGR channel order)
+        keys = [(k_b, S_b), (k_g, S_g), (k_r, S_r)]
 
-        #create a copy of the source to manipulate
-        src_copy = np.copy(src)
+    return src, keys
 
-        for s in range(1, S+1):
-            
-            for r in range(0, rows):
+def scrambleBatch(images, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b, inverse = False, workers = None, cache_bytes = 2**30):
 
-                for c in range(0, cols):
+    """ Scrambles (or unscrambles) a batch of images with the same key parameters.
 
-                    #get the new coordinate
-                    new_row_coordinate = ((a1 * r) + (a2 * c)) % rows
-                    new_col_coordinate = ((a3 * r) + (a4 * c)) % cols
+    Details: Images are decoded and transformed across a thread pool. While the batch runs, the
+             gather maps are kept in an LRU cache keyed by (N, k, S) holding at most cache_bytes,
+             so a batch of same-size images computes each map once instead of once per image.
 
-                    #place the code value at the new coordinate
-                    scrambled[new_row_coordinate, new_col_coordinate] = src_copy[r,c]
+    Args:
+        images (str or iterable): Directory of images, or an iterable of image paths and/or already loaded arrays
+        k, S, c, k_r, k_g, k_b, S_r, S_g, S_b: The key parameters, exactly as in scramble()
+        inverse (bool): Unscramble the images instead, exactly as in unscramble()
+        workers (int): The number of threads. Defaults to the number of cores.
+        cache_bytes (int): Memory budget of the gather map cache, released when the batch is done
 
-            #pass along most recent scramble for the next scramble
-            src_copy = np.copy(scrambled)
+    Returns:
+        scrambled (generator): Yields (name, dst) pairs in input order. name is the file name for
+                               paths and the position in the batch for arrays. dst is -1 for an
+                               image that isn't square, or whose channels don't match c.
 
-        return scrambled 
+    """
 
-    #for color images
-    elif (c == True):
+    if (isinstance(images, str)):
 
-        #define common parameters
-        a1 = 1
-        a2 = 1
+        directory = images
+        images = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+        images = [image for image in images if os.path.isfile(image)]
 
-        #define color-dependant paramaters
-        a3_r = k_r
-        a3_g = k_g
-        a3_b = k_b
-        a4_r = k_r + 1
-        a4_g = k_g + 1
-        a4_b = k_b + 1
+    if (workers is None):
 
-        #read in image as color
-        src = cv2.imread(path, cv2.IMREAD_COLOR) 
+        workers = os.cpu_count() or 1
 
-        #get the rows, cols, chans in the image
-        rows = np.shape(src)[0]
-        cols = np.shape(src)[1]
-        chans = np.shape(src)[2]
+    def transform(item):
+
+        position, image = item
+
+        if (isinstance(image, np.ndarray)):
+
+            name = position
+            src = image
+            keys = _read_keyed_image(None, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b)[1]
+
+        else:
+
+            name = os.path.basename(image)
+            src, keys = _read_keyed_image(image, k, S, c, k_r, k_g, k_b, S_r, S_g, S_b)
 
         #ensure input image is square
-        if (rows != cols):
+        if (src is None or np.ndim(src) < 2 or np.shape(src)[0] != np.shape(src)[1]):
 
             print("ERROR: Please provide a square image to scramble.")
-            return -1
-        
-        #get the image channels
-        blue_channel = src[:,:,0]
-        green_channel = src[:,:,1]
-        red_channel = src[:,:,2]
+            print("IMAGE:", name)
+            return name, -1
+
+        if (inverse):
+
+            keys = [(key, -scrambles) for key, scrambles in keys]
+
+        dst = _scramble_image(src, keys)
+
+        if (isinstance(dst, int)):
+
+            print("IMAGE:", name)
+
+        return name, dst
+
+    return _batch(transform, enumerate(images), workers, cache_bytes)
+
+def _batch(transform, items, workers, cache_bytes):
+
+    """ Yields transform(item) in order, only keeping a couple of items per thread in flight """
+
+    with _map_cache_budget(cache_bytes), ThreadPoolExecutor(max_workers = workers) as pool:
+
+        pending = []
+
+        for item in items:
+
+            pending.append(pool.submit(transform, item))
+
+            if (len(pending) >= 2 * workers):
+
+                yield pending.pop(0).result()
+
+        for future in pending:
+
+            yield future.result()
+
+def scrambleTiled(src_path, dst_path, block, k, S, inverse = False, shape = None, workers = None):
+
+    """ Scrambles (or unscrambles) an image of any shape, block by block, without loading it into memory.
+
+    Details: The image is cut into a grid of block x block squares. Blocks on the right and bottom
+             edges are cut further into the largest squares that fit, so every pixel lands in some
+             square (small leftover squares barely move their pixels, so prefer a block size that
+             divides the image). Each square is scrambled with the automorphism of its own size N using the
+             same k and S. Rows of blocks are farmed out to a process pool, and every worker reads
+             and writes its blocks through memory maps of the input and output.
+
+    Args:
+        src_path (str): Path to the 8-bit input, either a .npy file or raw bytes
+        dst_path (str): Path to write the output to, either a .npy file or raw bytes
+        block (int): Side length of the square blocks
+        k (int): Free parameter in the automorphism that acts as a "secret key"
+        S (int): The number of scrambles that you want to perform
+        inverse (bool): Unscramble an image made by scrambleTiled with the same block, k and S instead
+        shape (tuple): (rows, cols) or (rows, cols, chans) of the input. Only required for raw input.
+        workers (int): The number of worker processes. Defaults to the number of cores.
+
+    Returns:
+        dst (numpy.memmap): The scrambled image
+
+    """
+
+    if (block < 1):
+
+        print("ERROR: PLEASE ENTER A VALID BLOCK SIZE")
+        return -1
+
+    src = _open_memmap(src_path, 'r', shape)
+
+    if (src is None):
+
+        print("ERROR: PLEASE PROVIDE THE SHAPE OF A RAW INPUT IMAGE")
+        return -1
+
+    shape = np.shape(src)
+    del src
+
+    dst = _open_memmap(dst_path, 'w+', shape)
+    dst.flush()
+    del dst
+
+    if (workers is None):
+
+        workers = os.cpu_count() or 1
+
+    if (inverse):
+
+        S = -S
+
+    rows = shape[0]
+    cols = shape[1]
+
+    #one task per row of blocks
+    tasks = []
+
+    for r in range(0, rows, block):
+
+        squares = []
+
+        for c in range(0, cols, block):
+
+            squares.extend(_square_blocks(r, c, min(block, rows - r), min(block, cols - c)))
+
+        tasks.append((src_path, dst_path, shape, squares, k, S))
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+
+        list(pool.map(_scramble_blocks, tasks))
+
+    return _open_memmap(dst_path, 'r', shape)
+
+def _scramble_blocks(task):
+
+    """ Scrambles a list of square blocks from the memory-mapped input into the memory-mapped output """
+
+    src_path, dst_path, shape, squares, k, S = task
+
+    src = _open_memmap(src_path, 'r', shape)
+    dst = _open_memmap(dst_path, 'r+', shape)
+
+    #most blocks are the same size, so keep their maps for the whole task
+    with _map_cache_budget(2**30):
+
+        for r, c, N in squares:
+
+            square = np.array(src[r:r+N, c:c+N])
+            keys = [(k, S)] * (square.size // (N * N))
+            dst[r:r+N, c:c+N] = _scramble_image(square, keys)
+
+    dst.flush()
+
+def _square_blocks(r, c, h, w):
+
+    """ Cuts an h x w rectangle at (r, c) into squares, as (row, col, side) triples """
+
+    squares = []
+
+    while (h > 0 and w > 0):
+
+        n = min(h, w)
+
+        #lay as many n x n squares as fit along the long side, then cut up what is left over
+        if (h <= w):
+
+            count = w // n
+            squares.extend([(r, c + (i * n), n) for i in range(0, count)])
+            c = c + (count * n)
+            w = w - (count * n)
+
+        else:
+
+            count = h // n
+            squares.extend([(r + (i * n), c, n) for i in range(0, count)])
+            r = r + (count * n)
+            h = h - (count * n)
+
+    return squares
+
+def _open_memmap(path, mode, shape):
+
+    """ Memory maps an 8-bit image stored as .npy or raw bytes (None if a raw input has no shape) """
+
+    if (path.endswith('.npy')):
+
+        if (mode == 'w+'):
+
+            return np.lib.format.open_memmap(path, mode = mode, dtype = np.uint8, shape = tuple(shape))
+
+        return np.load(path, mmap_mode = mode)
+
+    if (shape is None):
+
+        return None
+
+    return np.memmap(path, dtype = np.uint8, mode = mode, shape = tuple(shape))
+
+def scramblePeriod(N, k, cache_path = None):
+
+    """ Computes the period T of the scrambling automorphism for an NxN image and free parameter k.
+
+    Details: Scrambling S times moves (r, c) to A^S (r, c) mod N with A = [[1, 1], [k, k + 1]], so
+             the image first comes back once A^T is the identity mod N. T is the order of A in
+             GL2(Z_N). N is factored into prime powers p^e, the order of A mod each p^e is found
+             by trimming prime factors off the size of SL2(Z_(p^e)), p^(3e - 2) * (p^2 - 1), and
+             the orders are combined with a least common multiple.
+
+    Args:
+        N (int): Size of the NxN image
+        k (int): Free parameter in the automorphism that acts as a "secret key"
+        cache_path (str): File that keeps computed periods across runs, keyed by (N, k). Every new
+                          period is appended to it as one JSON object per line. If it can't be
+                          written, the period is still returned. Defaults to ~/.cache/nero/scramble_periods.json.
+
+    Returns:
+        T (int): The period of the automorphism
+
+    """
+
+    if (N < 1):
+
+        print("ERROR: PLEASE ENTER A VALID IMAGE SIZE")
+        return -1
+
+    #the automorphism only depends on k mod N
+    k = k % N
+
+    if (cache_path is None):
+
+        cache_path = os.path.join(os.path.expanduser('~'), '.cache', 'nero', 'scramble_periods.json')
 
-        #instantiate blank arrays for the scrambled color channels
-        blue_channel_scrambled = np.zeros((rows, cols), dtype = np.uint8)
-        green_channel_scrambled = np.zeros((rows,cols), dtype = np.uint8)
-        red_channel_scrambled = np.zeros((rows, cols), dtype = np.uint8)
+    cache = _period_cache(cache_path)
+    key = str(N) + ',' + str(k)
 
-        #get copies of the image channels
-        blue_channel_copy = np.copy(blue_channel)
-        green_channel_copy = np.copy(green_channel)
-        red_channel_copy = np.copy(red_channel)
+    if (key in cache):
 
-        #scramble the red channel
-        for s in range(1, S_r+1):
-            
-            for r in range(0, rows):
+        return cache[key]
 
-                for c in range(0, cols):
+    T = 1
 
-                    #get the new coordinate for the red channel
-                    new_row_coordinate = ((a1 * r) + (a2 * c)) % rows
-                    new_col_coordinate_r = ((a3_r * r) + (a4_r * c)) % cols
+    for p, e in _factor(N).items():
 
-                    #place the code value for each channel at the new coordinate
-                    red_channel_scrambled[new_row_coordinate, new_col_coordinate_r] = red_channel_copy[r,c]
+        T = _lcm(T, _order_mod_prime_power(k, p, e))
 
-            #pass along most recent scrambles for the next scrambles
-            red_channel_copy = np.copy(red_channel_scrambled)
+    cache[key] = T
 
-        #scramble the green channel
-        for s in range(1, S_g+1):
-            
-            for r in range(0, rows):
+    #append just the new period rather than rewriting the whole file
+    if (cache_path not in _unwritable_caches):
 
-                for c in range(0, cols):
+        try:
 
-                    #get the new coordinate for the green channel
-                    new_row_coordinate = ((a1 * r) + (a2 * c)) % rows
-                    new_col_coordinate_g = ((a3_g * r) + (a4_g * c)) % cols
+            directory = os.path.dirname(cache_path)
 
-                    #place the code value for each channel at the new coordinate
-                    green_channel_scrambled[new_row_coordinate, new_col_coordinate_g] = green_channel_copy[r,c]
+            if (directory != ''):
 
-            #pass along most recent scrambles for the next scrambles
-            green_channel_copy = np.copy(green_channel_scrambled)
+                os.makedirs(directory, exist_ok = True)
+
+            with open(cache_path, 'a') as f:
+
+                f.write(json.dumps({key: T}) + '\n')
+
+        except OSError as error:
+
+            #keep going without the file, and only say so once
+            print("WARNING: COULD NOT WRITE THE PERIOD CACHE, PERIODS WILL NOT BE KEPT ACROSS RUNS")
+            print("CACHE:", cache_path, "|", error)
+            _unwritable_caches.add(cache_path)
+
+    return T
+
+#periods loaded from each cache file, so the file is only read once per process
+_period_caches = {}
+
+#cache files that could not be written to
+_unwritable_caches = set()
+
+def _period_cache(cache_path):
+
+    """ Loads (once) the period cache stored at cache_path, one JSON object of periods per line """
+
+    if (cache_path not in _period_caches):
+
+        cache = {}
+
+        try:
+
+            with open(cache_path) as f:
+
+                for line in f:
+
+                    #a line cut short by an interrupted write is skipped
+                    try:
+
+                        cache.update(json.loads(line))
+
+                    except ValueError:
+
+                        continue
+
+        except OSError:
+
+            pass
+
+        _period_caches[cache_path] = cache
+
+    return _period_caches[cache_path]
+
+def _order_mod_prime_power(k, p, e):
+
+    """ Order of [[1, 1], [k, k + 1]] mod p^e """
+
+    modulus = p ** e
+
+    #the order divides the size of SL2(Z_(p^e)), as the matrix has determinant one
+    order = (p ** ((3 * e) - 2)) * ((p * p) - 1)
+
+    factors = _factor((p * p) - 1)
+    factors[p] = factors.get(p, 0) + (3 * e) - 2
+
+    identity = [[1 % modulus, 0], [0, 1 % modulus]]
+
+    #trim off every prime factor that isn't needed to reach the identity
+    for q in factors:
+
+        while (order % q == 0 and _automorphism_power(modulus, k, order // q) == identity):
+
+            order = order // q
+
+    return order
+
+def _factor(n):
+
+    """ Factors n into a {prime: exponent} dict by trial division """
+
+    factors = {}
+    d = 2
+
+    while (d * d <= n):
+
+        while (n % d == 0):
+
+            factors[d] = factors.get(d, 0) + 1
+            n = n // d
+
+        d = d + 1 if d == 2 else d + 2
+
+    if (n > 1):
+
+        factors[n] = factors.get(n, 0) + 1
+
+    return factors
+
+def _lcm(a, b):
+
+    """ Least common multiple of two positive ints """
+
+    return (a // math.gcd(a, b)) * b
+
+def _scramble_image(src, keys):
+
+    """ Scrambles every channel of a square image with its own (k, S) key.
+
+    Args:
+        src (numpy.ndarray): NxN grayscale or NxNx3 color image
+        keys (list): One (k, S) pair per channel
+
+    Returns:
+        scrambled (numpy.ndarray): The scrambled image, -1 if there isn't one key per channel
+
+    """
+
+    #treat grayscale as a single channel image
+    channels = src.reshape(np.shape(src)[0], np.shape(src)[1], -1)
+
+    #every channel has to be scrambled, or the result would hold unwritten memory
+    if (len(keys) != np.shape(channels)[2]):
+
+        print("ERROR: PLEASE PROVIDE A GRAYSCALE IMAGE WITHOUT c, OR A 3 CHANNEL IMAGE WITH c")
+        print("CHANNELS:", np.shape(channels)[2], "KEYS:", len(keys))
+        return -1
+
+    scrambled = np.empty(np.shape(channels), dtype = src.dtype)
+
+    N = np.shape(src)[0]
+
+    #channels sharing a key share a gather map, even when nothing is being cached
+    gathers = {}
+
+    for chan, (k, S) in enumerate(keys):
+
+        if ((k % N, S) not in gathers):
+
+            gathers[(k % N, S)] = _cached_scramble_map(N, k, S)
+
+        #all S scrambles collapse into a single gather
+        scrambled[:, :, chan] = channels[:, :, chan].ravel()[gathers[(k % N, S)]].reshape(N, N)
+
+    return scrambled.reshape(np.shape(src))
+
+#gather maps shared by every batch in flight, most recently used last
+_map_cache = OrderedDict()
+_map_cache_lock = threading.Lock()
+
+#memory budgets of the batches in flight, maps are only cached while there is one
+_map_cache_budgets = []
+
+#maps being built right now, so other threads wait for them rather than building them again
+_map_builds = {}
+
+@contextmanager
+def _map_cache_budget(cache_bytes):
+
+    """ Caches gather maps, within cache_bytes, for as long as the with block runs """
+
+    with _map_cache_lock:
+
+        _map_cache_budgets.append(cache_bytes)
+
+    try:
+
+        yield
+
+    finally:
+
+        with _map_cache_lock:
+
+            _map_cache_budgets.remove(cache_bytes)
+            _trim_map_cache()
+
+def _cached_scramble_map(N, k, S):
+
+    """ _scramble_map through an LRU cache keyed by (N, k, S), built only once however many threads ask for it """
+
+    key = (N, k % N, S)
+
+    with _map_cache_lock:
+
+        if (key in _map_cache):
+
+            _map_cache.move_to_end(key)
+            return _map_cache[key]
+
+        build = _map_builds.get(key)
+        building = build is None
+
+        if (building):
+
+            build = Future()
+            _map_builds[key] = build
+
+    #another thread is already building this map, so wait for it
+    if (not building):
+
+        return build.result()
+
+    try:
+
+        gather = _scramble_map(N, k, S)
+
+    except BaseException as error:
+
+        with _map_cache_lock:
+
+            del _map_builds[key]
+
+        build.set_exception(error)
+        raise
+
+    with _map_cache_lock:
+
+        del _map_builds[key]
+
+        if (len(_map_cache_budgets) > 0):
+
+            _map_cache[key] = gather
+            _trim_map_cache()
+
+    build.set_result(gather)
+
+    return gather
+
+def _trim_map_cache():
+
+    """ Evicts the least recently used maps until the cache fits the largest budget in flight (hold _map_cache_lock) """
+
+    limit = max(_map_cache_budgets, default = 0)
+
+    while (sum(m.nbytes for m in _map_cache.values()) > limit and len(_map_cache) > 0):
+
+        _map_cache.popitem(last = False)
+
+def _automorphism_power(N, k, S):
+
+    """ Raises the automorphism matrix [[1, 1], [k, k + 1]] to the power S mod N by repeated squaring.
+        A negative S raises the inverse matrix [[k + 1, -1], [-k, 1]] instead.
+
+    Returns:
+        matrix (list): [[a1, a2], [a3, a4]] with every entry in [0:N)
+
+    """
+
+    #establish parameters for this toral automorphic family
+    if (S >= 0):
+
+        base = [[1, 1], [k % N, (k + 1) % N]]
+
+    else:
+
+        base = [[(k + 1) % N, N - 1], [(-k) % N, 1 % N]]
+        S = -S
+
+    #start from the identity
+    matrix = [[1 % N, 0], [0, 1 % N]]
+
+    while (S > 0):
+
+        if (S & 1):
+
+            matrix = _matrix_product(matrix, base, N)
+
+        base = _matrix_product(base, base, N)
+        S = S >> 1
+
+    return matrix
+
+def _matrix_product(x, y, N):
+
+    """ Multiplies two 2x2 matrices mod N (python ints, so nothing overflows) """
+
+    return [[((x[0][0] * y[0][0]) + (x[0][1] * y[1][0])) % N, ((x[0][0] * y[0][1]) + (x[0][1] * y[1][1])) % N],
+            [((x[1][0] * y[0][0]) + (x[1][1] * y[1][0])) % N, ((x[1][0] * y[0][1]) + (x[1][1] * y[1][1])) % N]]
+
+def _scramble_map(N, k, S):
+
+    """ Builds the flat gather index of S scrambles of an NxN image with free parameter k.
+
+    Details: S scrambles send the code value at (r, c) to A^S (r, c) mod N, where A = [[1, 1], [k, k + 1]].
+             The output pixel at (r, c) therefore reads the input pixel at A^-S (r, c) mod N.
+             A negative S gives the map that undoes -S scrambles.
+
+    """
 
-        #scramble the blue channel
-        for s in range(1, S_b+1):
-            
-            for r in range(0, rows):
+    [[a1, a2], [a3, a4]] = _automorphism_power(N, k, -S)
 
-                for c in range(0, cols):
+    r, c = np.indices((N, N))
 
-                    #get the new coordinate for the blue channel
-                    new_row_coordinate = ((a1 * r) + (a2 * c)) % rows
-                    new_col_coordinate_b = ((a3_b * r) + (a4_b * c)) % cols
+    #get the coordinate every output pixel reads from
+    row_coordinate = ((a1 * r) + (a2 * c)) % N
+    col_coordinate = ((a3 * r) + (a4 * c)) % N
 
-                    #place the code value for each channel at the new coordinate
-                    blue_channel_scrambled[new_row_coordinate, new_col_coordinate_b] = blue_channel_copy[r,c]
+    gather = ((row_coordinate * N) + col_coordinate).ravel()
 
-            #pass along most recent scrambles for the next scrambles
-            blue_channel_copy = np.copy(blue_channel_scrambled)
+    #half the memory (and gather bandwidth) whenever the indices fit
+    if (N * N < 2**31):
 
-        #assemble the channels into a list to be merged
-        reconstruction_list = [red_channel_scrambled, green_channel_scrambled, blue_channel_scrambled]
-        
-        #bring the channels together
-        reconstructed = cv2.merge(reconstruction_list)
+        return gather.astype(np.int32)
 
-        return reconstructed
+    return gather